@@ -0,0 +1,841 @@
+"""Micro-benchmarks for the PDF Renamer rendering / OCR hot paths.
+
+Usage:
+    python benchmark.py {pixmap,viewer,preprocess,ocr-batch,discovery,pipeline,sweep}
+                        [--repeat N] [--count N] [--seed N] [--json out.json]
+                        [--corpus DIR] [--grid 'render_zoom=2,4;upscale=1,1.8'] [--config config.txt]
+
+ocr-batch and sweep need a working tesseract installation; pipeline skips
+its OCR stage without one. The JSON file holds {"env": ..., "results": [...]} so
+runs can be compared across commits.
+"""
+import argparse
+import gc
+import inspect
+import io
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    # 任意: Windowsでのメモリ計測用
+    import psutil
+except ImportError:
+    psutil = None
+
+from pdf_renamer import (OCR_TIERS, OCRPreprocessor, RenamerEngine, SessionLog, configure_tesseract, iter_pdf_files,
+                         load_config_file, pixmap_to_numpy, pixmap_to_pil, render_area_image, render_viewer_image)
+
+A4_WIDTH, A4_HEIGHT = 595, 842  # points
+
+
+def make_scan_pdf(dpi=300, seed=0):
+    """Create an in-memory single-page A4 PDF holding a noisy grayscale 'scan'."""
+    rng = np.random.default_rng(seed)
+    width = int(A4_WIDTH / 72 * dpi)
+    height = int(A4_HEIGHT / 72 * dpi)
+    scan = rng.normal(235, 12, (height, width)).clip(0, 255).astype(np.uint8)
+    ok, png = cv2.imencode('.png', scan)
+    if not ok:
+        raise RuntimeError("PNG encode failed")
+    doc = fitz.open()
+    page = doc.new_page(width=A4_WIDTH, height=A4_HEIGHT)
+    page.insert_image(page.rect, stream=png.tobytes())
+    page.insert_text((60, 160), "12345678-999", fontsize=28)
+    return doc
+
+
+def time_call(func, repeat):
+    """Return the median wall time of func() in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def bench_pixmap(repeat=5):
+    """Compare PPM encode/decode against the zero-copy Pixmap conversion."""
+    doc = make_scan_pdf()
+    page = doc[0]
+    results = []
+    for zoom in (2.0, 4.0):
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+        def legacy_pil():
+            Image.open(io.BytesIO(pix.tobytes("ppm"))).load()
+
+        def shared_pil():
+            pixmap_to_pil(pix).load()
+
+        def legacy_cv():
+            pil_image = Image.open(io.BytesIO(pix.tobytes("ppm")))
+            bgr = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+
+        def shared_cv():
+            cv2.cvtColor(pixmap_to_numpy(pix), cv2.COLOR_RGB2GRAY)
+
+        for target, old, new in (("PIL", legacy_pil, shared_pil), ("OpenCV gray", legacy_cv, shared_cv)):
+            old_ms = time_call(old, repeat)
+            new_ms = time_call(new, repeat)
+            results.append({
+                "bench": "pixmap",
+                "zoom": zoom,
+                "size": [pix.width, pix.height],
+                "target": target,
+                "legacy_ms": round(old_ms, 3),
+                "new_ms": round(new_ms, 3),
+                "speedup": round(old_ms / new_ms, 2) if new_ms else None,
+            })
+    doc.close()
+    return results
+
+
+def legacy_viewer_image(page, canvas_width, canvas_height):
+    """The pre-clip viewer path: full page at 2x, crop left half, LANCZOS cover resize."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))
+    pil_image = Image.open(io.BytesIO(pix.tobytes("ppm")))
+    width, height = pil_image.size
+    left_half = pil_image.crop((0, 0, width // 2, height))
+    img_w, img_h = left_half.size
+    scale = max(canvas_width / img_w, canvas_height / img_h)
+    new_w, new_h = int(img_w * scale), int(img_h * scale)
+    resized = left_half.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    left = max(0, (new_w - canvas_width) // 2)
+    top = max(0, (new_h - canvas_height) // 2)
+    filled = resized.crop((left, top, left + canvas_width, top + canvas_height))
+    return filled, pix.width * pix.height + new_w * new_h
+
+
+def bench_viewer(repeat=5):
+    """Compare the legacy full-page viewer render with the clip-rendered one (and its draft) on a 600dpi scan."""
+    doc = make_scan_pdf(dpi=600)
+    page = doc[0]
+    results = []
+    for canvas in ((640, 900), (960, 1000)):
+        _, legacy_pixels = legacy_viewer_image(page, *canvas)
+        clip_image = render_viewer_image(page, *canvas)[0]
+        old_ms = time_call(lambda: legacy_viewer_image(page, *canvas), repeat)
+        new_ms = time_call(lambda: render_viewer_image(page, *canvas), repeat)
+        draft_ms = time_call(lambda: render_viewer_image(page, *canvas, draft=0.25), repeat)
+        results.append({
+            "bench": "viewer",
+            "zoom": 2.0,
+            "size": list(canvas),
+            "target": "canvas",
+            "legacy_ms": round(old_ms, 3),
+            "new_ms": round(new_ms, 3),
+            "speedup": round(old_ms / new_ms, 2) if new_ms else None,
+            "draft_ms": round(draft_ms, 3),
+            "legacy_pixels": legacy_pixels,
+            "clip_pixels": clip_image.width * clip_image.height,
+        })
+    doc.close()
+    return results
+
+
+# 枠・OCR範囲（config.txt のレイアウトをそのまま使う）
+LAYOUT_KEYS = [f'{prefix}_{name}' for prefix in ('red_frame', 'blue_frame', 'ocr')
+               for name in ('x', 'y', 'width', 'height')]
+
+
+def benchmark_config(path="config.txt"):
+    """Load path (built-in defaults if it is missing) with OCR caching and debug images off.
+
+    The frame and OCR positions are taken as configured, so the synthetic
+    pages exercise the layout the app is actually used with.
+    """
+    config = load_config_file(path)
+    missing = [key for key in LAYOUT_KEYS if key not in config]
+    if missing:
+        raise SystemExit(f"{path}: frame / OCR area settings missing: {', '.join(missing)}")
+    config.update(ocr_image_folder='', ocr_cache_max_entries=0)
+    return config
+
+
+def layout_rects(config):
+    """Return {'red_frame' | 'blue_frame' | 'ocr': (x0, y0, x1, y1)} in PDF points."""
+    rects = {}
+    for prefix in ('red_frame', 'blue_frame', 'ocr'):
+        x, y, w, h = (config[f'{prefix}_{name}'] for name in ('x', 'y', 'width', 'height'))
+        rects[prefix] = (x, y, x + w, y + h)
+    return rects
+
+
+def fit_page_size(page_size, config, margin=20):
+    """Grow page_size (points) where needed so every configured region lies on the page."""
+    rects = layout_rects(config).values()
+    return (max(page_size[0], max(rect[2] for rect in rects) + margin),
+            max(page_size[1], max(rect[3] for rect in rects) + margin))
+
+
+def insert_number(page, key, config, rng, fontname="helv"):
+    """Write <key>-999 inside the configured OCR area at a random size and offset."""
+    x0, y0, x1, y1 = layout_rects(config)['ocr']
+    # 高さの4〜5割の文字サイズ（12文字が幅に収まる範囲）
+    fontsize = min(float(rng.uniform(0.36, 0.52)) * (y1 - y0), (x1 - x0 - 25) / 7.0)
+    page.insert_text((x0 + rng.uniform(5, 20), (y0 + y1) / 2 + fontsize / 3), f"{key}-999",
+                     fontname=fontname, fontsize=fontsize)
+
+
+def make_number_crops(count, seed=0, config=None):
+    """Render count pages with random 8-digit-999 numbers; return (keys, preprocessed crops)."""
+    rng = np.random.default_rng(seed)
+    config = config or benchmark_config()
+    engine = RenamerEngine(config, log=lambda message: None)
+    page_size = fit_page_size((A4_WIDTH, A4_HEIGHT), config)
+    keys, crops = [], []
+    for _ in range(count):
+        key = "".join(str(d) for d in rng.integers(0, 10, 8))
+        doc = fitz.open()
+        page = doc.new_page(width=page_size[0], height=page_size[1])
+        insert_number(page, key, config, rng)
+        crops.append(engine.preprocess_image_for_ocr(engine.render_ocr_area(page)).copy())
+        keys.append(key)
+        doc.close()
+    return keys, crops
+
+
+def bench_ocr_batch(repeat=1, count=50, seed=0, config="config.txt"):
+    """Compare per-crop OCR with one multi-page TIFF run (ocr_multipage_tiff=1) over the same crops.
+
+    Both paths go through recognize_batch(), as read_pages() does. same_key
+    counts the crops whose accepted key is identical on both paths; parity
+    is True only when every crop matches, which ocr_multipage_tiff=1
+    requires before it can be enabled.
+    """
+    configure_tesseract()
+    if not tesseract_available():
+        raise SystemExit("ocr-batch: tesseract not found")
+    settings = benchmark_config(config)
+    keys, crops = make_number_crops(count, seed=seed, config=settings)
+    single_engine = RenamerEngine(dict(settings, ocr_backend='pytesseract', ocr_multipage_tiff=0), log=print)
+    batch_engine = RenamerEngine(dict(settings, ocr_backend='pytesseract', ocr_multipage_tiff=1), log=print)
+
+    single_texts = []
+    per_crop_ms = time_call(lambda: single_texts.__setitem__(
+        slice(None), [text for text, _ in single_engine.recognize_batch(crops)]), repeat)
+    batch_texts = []
+    batch_ms = time_call(lambda: batch_texts.__setitem__(
+        slice(None), [text for text, _ in batch_engine.recognize_batch(crops)]), repeat)
+    single_engine.close()
+    batch_engine.close()
+
+    single_keys = [single_engine.match_key(text) for text in single_texts]
+    batch_keys = [batch_engine.match_key(text) for text in batch_texts]
+    same_key = sum(a == b for a, b in zip(single_keys, batch_keys))
+    return [{
+        "bench": "ocr-batch",
+        "backend": "pytesseract",
+        "crops": count,
+        "per_crop_ms": round(per_crop_ms / count, 3),
+        "batch_ms": round(batch_ms / count, 3),
+        "speedup": round(per_crop_ms / batch_ms, 2) if batch_ms else None,
+        "same_key": same_key,
+        "parity": same_key == count,
+        "correct_single": sum(a == k for a, k in zip(single_keys, keys)),
+        "correct_batch": sum(b == k for b, k in zip(batch_keys, keys)),
+    }]
+
+
+def legacy_preprocess(image):
+    """The pre-OCRPreprocessor pipeline: fresh CLAHE/arrays per call, 1x1 dilate, 1.8x LANCZOS."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    enhanced = clahe.apply(gray)
+    denoised = cv2.medianBlur(enhanced, 3)
+    binary = cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8), iterations=1)
+    dilated = cv2.dilate(closed, np.ones((1, 1), np.uint8), iterations=1)
+    height, width = dilated.shape
+    return cv2.resize(dilated, (int(width * 1.8), int(height * 1.8)), interpolation=cv2.INTER_LANCZOS4)
+
+
+def bench_preprocess(repeat=5, count=20, seed=0, config="config.txt"):
+    """Compare the legacy OCR preprocessing with OCRPreprocessor (default and direct-render profiles).
+
+    Timings include rendering the OCR area. The legacy and new pipelines
+    run alternately in each of repeat rounds, so machine noise hits both
+    alike; speedup is the median of the per-round ratios and speedup_range
+    their spread. 'agreement' is the share of output pixels equal to the
+    legacy output (only for same-size outputs).
+    """
+    rng = np.random.default_rng(seed)
+    settings = benchmark_config(config)
+    rect = fitz.Rect(layout_rects(settings)['ocr'])
+    page_size = fit_page_size((A4_WIDTH, A4_HEIGHT), settings)
+    doc = fitz.open()
+    for _ in range(count):
+        page = doc.new_page(width=page_size[0], height=page_size[1])
+        key = "".join(str(d) for d in rng.integers(0, 10, 8))
+        insert_number(page, key, settings, rng)
+
+    def legacy_run():
+        outputs = []
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(4.0, 4.0), clip=rect)
+            pil_image = Image.open(io.BytesIO(pix.tobytes("ppm")))
+            outputs.append(legacy_preprocess(cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)))
+        return outputs
+
+    def preprocessor_run(preprocessor):
+        outputs = []
+        zoom = preprocessor.render_zoom
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect, colorspace=fitz.csGRAY)
+            outputs.append(preprocessor.process(pixmap_to_numpy(pix)).copy())
+        return outputs
+
+    profiles = {
+        "default": OCRPreprocessor(),
+        # 比較用: 7.2x で直接描画し拡大を省略（ブロック/メディアンを解像度に合わせて拡大）
+        "direct7.2x": OCRPreprocessor(render_zoom=7.2, upscale=1.0, block_size=55, median_ksize=5,
+                                      close_kernel=3),
+    }
+    legacy_outputs = legacy_run()
+    outputs_by_profile = {name: preprocessor_run(preprocessor) for name, preprocessor in profiles.items()}
+    samples = {name: [] for name in ("legacy", *profiles)}
+    for _ in range(repeat):
+        samples["legacy"].append(time_call(legacy_run, 1))
+        for name, preprocessor in profiles.items():
+            samples[name].append(time_call(lambda: preprocessor_run(preprocessor), 1))
+    legacy_ms = statistics.median(samples["legacy"]) / count
+    results = []
+    for name, outputs in outputs_by_profile.items():
+        new_ms = statistics.median(samples[name]) / count
+        ratios = [old / new for old, new in zip(samples["legacy"], samples[name])]
+        same = [np.mean(a == b) for a, b in zip(legacy_outputs, outputs) if a.shape == b.shape]
+        results.append({
+            "bench": "preprocess",
+            "profile": name,
+            "crop": list(outputs[0].shape[::-1]),
+            "legacy_ms": round(legacy_ms, 3),
+            "new_ms": round(new_ms, 3),
+            "speedup": round(statistics.median(ratios), 2),
+            "speedup_range": [round(min(ratios), 2), round(max(ratios), 2)],
+            "agreement": round(float(np.mean(same)), 4) if same else None,
+        })
+    doc.close()
+    return results
+
+
+def print_table(results):
+    for r in results:
+        print("  ".join(f"{key}={value}" for key, value in r.items()))
+
+
+def make_pdf_tree(root, count, folders):
+    """Create count empty scan_N.pdf files spread over date-like subfolders."""
+    for i in range(count):
+        folder = os.path.join(root, f"2024-01-{i % folders + 1:02d}")
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, f"scan_{i}.pdf"), 'wb').close()
+
+
+def bench_discovery(repeat=5):
+    """Compare listdir + sort with lazy scandir discovery on flat and nested folders."""
+    results = []
+    for count, folders in ((20000, 1), (20000, 20)):
+        root = tempfile.mkdtemp(prefix="pdf_discovery_")
+        try:
+            make_pdf_tree(root, count, folders)
+            flat = os.path.join(root, "2024-01-01")
+            target = flat if folders == 1 else root
+            recursive = folders > 1
+
+            def legacy():
+                # 旧実装（直下のみ・文字列順）
+                return sorted(f for f in os.listdir(flat) if f.lower().endswith('.pdf'))
+
+            first_ms = time_call(lambda: next(iter_pdf_files(target, recursive=recursive)), repeat)
+            total_ms = time_call(lambda: sum(1 for _ in iter_pdf_files(target, recursive=recursive)), repeat)
+            results.append({
+                "bench": "discovery",
+                "files": count,
+                "folders": folders,
+                "legacy_flat_ms": round(time_call(legacy, repeat), 3) if folders == 1 else None,
+                "first_ms": round(first_ms, 3),
+                "total_ms": round(total_ms, 3),
+                "found": sum(1 for _ in iter_pdf_files(target, recursive=recursive)),
+            })
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+# ページサイズ（ポイント）とフォント（PyMuPDF内蔵）の候補
+PAGE_SIZES = {"A4": (595, 842), "Letter": (612, 792), "B5": (516, 729), "A4-landscape": (842, 595)}
+FONTS = ("helv", "cour", "tiro", "hebo")
+
+def make_synthetic_pdf(path, key, rng, config, page_size, pages=1, dpi=150, noise=10.0, skew=1.5):
+    """Write a scanned-looking PDF whose first page shows <key>-999 in the OCR area.
+
+    Each page is drawn as vectors, rasterized to grayscale at dpi, given
+    Gaussian noise and a random skew of up to +-skew degrees, and stored as
+    an image-only (JPEG) page, so the number has to be OCR'd. page_size is
+    grown where needed to hold the configured frames and OCR area.
+    """
+    width, height = fit_page_size(page_size, config)
+    rects = layout_rects(config)
+    doc = fitz.open()
+    for page_no in range(pages):
+        source = fitz.open()
+        page = source.new_page(width=width, height=height)
+        for prefix in ('red_frame', 'blue_frame'):
+            rect = fitz.Rect(rects[prefix])
+            page.draw_rect(rect, color=(0, 0, 0), width=0.8)
+            page.insert_textbox(rect + (6, 6, -6, -6), f"Item {rng.integers(1000, 9999)} / page {page_no + 1}",
+                                fontname=str(rng.choice(FONTS)), fontsize=11)
+        if page_no == 0:
+            insert_number(page, key, config, rng, fontname=str(rng.choice(FONTS)))
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY)
+        scan = pixmap_to_numpy(pix).astype(np.float32)
+        source.close()
+        scan += rng.normal(0, noise, scan.shape)
+        rows, cols = scan.shape
+        matrix = cv2.getRotationMatrix2D((cols / 2, rows / 2), float(rng.uniform(-skew, skew)), 1.0)
+        scan = cv2.warpAffine(scan.clip(0, 255).astype(np.uint8), matrix, (cols, rows), borderValue=255)
+        # スキャナ出力と同じくJPEGで埋め込む
+        ok, jpeg = cv2.imencode('.jpg', scan, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise RuntimeError("JPEG encode failed")
+        out = doc.new_page(width=width, height=height)
+        out.insert_image(out.rect, stream=jpeg.tobytes())
+    doc.save(path)
+    doc.close()
+
+
+def make_synthetic_corpus(folder, count, seed=0, config=None):
+    """Write count synthetic PDFs into folder; returns [(path, key)] in order.
+
+    The layout comes from config (default: benchmark_config()). Page sizes
+    and fonts rotate with the seed; every fourth file has three pages (the
+    number is on the first).
+    """
+    config = config or benchmark_config()
+    rng = np.random.default_rng(seed)
+    corpus = []
+    sizes = list(PAGE_SIZES.values())
+    for i in range(count):
+        key = "".join(str(d) for d in rng.integers(0, 10, 8))
+        path = os.path.join(folder, f"scan_{i:04d}.pdf")
+        make_synthetic_pdf(path, key, rng, config, sizes[int(rng.integers(len(sizes)))],
+                           pages=3 if i % 4 == 3 else 1)
+        corpus.append((path, key))
+    return corpus
+
+
+def tesseract_available():
+    try:
+        configure_tesseract()
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def current_rss_kb():
+    """Resident set size of this process in KB, or None if it cannot be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss // 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS counter (Linux >= 4.0); False where unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """Peak resident set size in KB: VmHWM on Linux, else the process-lifetime peak."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) // 1024
+    if resource is not None:
+        # ru_maxrss はLinuxではKB、macOSではバイト
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    return None
+
+
+def measure_stage(name, func, items, repeat):
+    """Peak RSS of one run of func(), then its time (median of repeat).
+
+    RSS covers every allocator (MuPDF, PIL and OpenCV buffers included).
+    rss_peak_kb is the stage's own peak where the kernel counter can be
+    reset (Linux; rss_scope='stage'), otherwise the process peak so far
+    (rss_scope='process'). rss_growth_kb is that peak minus the RSS
+    before the run.
+    """
+    # メモリ計測を先に行う（計時の反復で確保済みの領域を数えないため）
+    gc.collect()
+    before = current_rss_kb()
+    scope = 'stage' if reset_peak_rss() else 'process'
+    func()
+    peak = peak_rss_kb()
+    total_ms = time_call(func, repeat)
+    return {
+        "bench": "pipeline",
+        "stage": name,
+        "items": items,
+        "ms_per_item": round(total_ms / items, 3) if items else None,
+        "items_per_sec": round(items * 1000.0 / total_ms, 1) if total_ms else None,
+        "rss_peak_kb": peak,
+        "rss_growth_kb": peak - before if peak is not None and before is not None else None,
+        "rss_scope": scope,
+    }
+
+
+def bench_pipeline(repeat=5, count=40, seed=0, config="config.txt"):
+    """Time every stage of the rename pipeline on a synthetic scanned corpus.
+
+    Stages: open, viewer render, frame previews, OCR-area render,
+    preprocessing, OCR (skipped without tesseract), extract_digits, save
+    (copy and hard link) and the session CSV. Memory is the resident set
+    size (see measure_stage); rss_max_kb on the corpus row is the highest
+    stage peak. The frame / OCR layout comes from config.
+    """
+    root = tempfile.mkdtemp(prefix="pdf_pipeline_")
+    try:
+        input_folder = os.path.join(root, "input")
+        os.makedirs(input_folder)
+        config = dict(benchmark_config(config), pdf_input_folder=input_folder,
+                      log_output_folder=os.path.join(root, "log"))
+        corpus = make_synthetic_corpus(input_folder, count, seed=seed, config=config)
+        paths = [path for path, _ in corpus]
+        keys = [key for _, key in corpus]
+        engine = RenamerEngine(config, log=lambda message: None)
+        docs = [fitz.open(path) for path in paths]
+        pages = [doc[0] for doc in docs]
+        frames = [tuple(config[f'{prefix}_{name}'] for name in ('x', 'y', 'width', 'height'))
+                  for prefix in ('red_frame', 'blue_frame')]
+        frames = [(x, y, x + w, y + h) for x, y, w, h in frames]
+        results = []
+
+        def open_all():
+            for path in paths:
+                fitz.open(path).close()
+
+        def viewer_all():
+            for page in pages:
+                render_viewer_image(page, 960, 1000)
+
+        def previews_all():
+            for page in pages:
+                for rect in frames:
+                    render_area_image(page, rect, 400, 300)
+
+        raw = [engine.render_ocr_area(page) for page in pages]
+        crops = [engine.preprocess_image_for_ocr(image).copy() for image in raw]
+
+        def render_ocr_all():
+            for page in pages:
+                engine.render_ocr_area(page)
+
+        def preprocess_all():
+            for image in raw:
+                engine.preprocess_image_for_ocr(image)
+
+        results.append(measure_stage("open", open_all, len(paths), repeat))
+        results.append(measure_stage("viewer", viewer_all, len(pages), repeat))
+        results.append(measure_stage("previews", previews_all, len(pages) * len(frames), repeat))
+        results.append(measure_stage("ocr-render", render_ocr_all, len(pages), repeat))
+        results.append(measure_stage("preprocess", preprocess_all, len(raw), repeat))
+
+        if tesseract_available():
+            texts = []
+            result = measure_stage("ocr", lambda: texts.__setitem__(
+                slice(None), [text for text, _ in engine.recognize_batch(crops)]), len(crops), 1)
+            result["backend"] = engine.ocr_backend.name
+            result["correct"] = sum(engine.match_key(text) == key for text, key in zip(texts, keys))
+            results.append(result)
+        else:
+            # OCRなしでも抽出処理は計測できるよう、正解に雑音文字を混ぜた文字列を使う
+            texts = [f" {key[:4]}.{key[4:]} -999|" for key in keys]
+            results.append({"bench": "pipeline", "stage": "ocr", "items": len(crops), "skipped": "tesseract not found"})
+
+        results.append(measure_stage("extract-digits", lambda: [engine.extract_digits(text) for text in texts],
+                                     len(texts), repeat))
+
+        for stage, hardlink in (("save-copy", 0), ("save-link", 1)):
+            output_folder = os.path.join(root, stage)
+
+            def save_all():
+                shutil.rmtree(output_folder, ignore_errors=True)
+                engine.config.update(pdf_output_folder=output_folder, output_hardlink=hardlink)
+                return [engine.save_output(path, key)[1] for path, key in corpus]
+
+            result = measure_stage(stage, save_all, len(corpus), repeat)
+            result["method"] = save_all()[0]
+            results.append(result)
+
+        csv_path = os.path.join(root, "session.csv")
+
+        def csv_all():
+            for suffix in ("", ".journal"):
+                if os.path.exists(csv_path + suffix):
+                    os.remove(csv_path + suffix)
+            session_log = SessionLog(csv_path, compact_every=config['csv_compact_every'], log=lambda message: None)
+            for path, key in corpus:
+                session_log.append(key, "", source_file=os.path.basename(path))
+            session_log.close()
+
+        results.append(measure_stage("csv", csv_all, len(corpus), repeat))
+
+        for doc in docs:
+            doc.close()
+        engine.close()
+        results.append({
+            "bench": "pipeline",
+            "stage": "corpus",
+            "items": len(corpus),
+            "pages": sum(3 if i % 4 == 3 else 1 for i in range(count)),
+            "bytes": sum(os.path.getsize(path) for path in paths),
+            "seed": seed,
+            "rss_max_kb": max((row["rss_peak_kb"] for row in results if row.get("rss_peak_kb")), default=None),
+        })
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# 既定の探索範囲: 描画倍率・拡大率・二値化ブロック
+DEFAULT_SWEEP_GRID = "render_zoom=2,3,4,6;upscale=1,1.8;block_size=15,31,45"
+
+
+def parse_grid(spec):
+    """Parse 'param=v1,v2;param=...' into [{param: value}] (the cartesian product).
+
+    Parameters are OCRPreprocessor arguments; steps takes '+'-joined step
+    lists (e.g. steps=threshold+resize,clahe+median+threshold+close+resize)
+    and preset names an OCR_TIERS entry used as the starting point.
+    """
+    axes = []
+    for part in spec.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, values = part.partition('=')
+        name = name.strip()
+        if name == 'steps':
+            parsed = [tuple(value.split('+')) for value in values.split(',')]
+        elif name == 'preset':
+            parsed = [value.strip() for value in values.split(',')]
+            unknown = [value for value in parsed if value not in OCR_TIERS]
+            if unknown:
+                raise ValueError(f"unknown preset: {unknown}")
+        else:
+            parsed = [float(value) for value in values.split(',')]
+        axes.append([(name, value) for value in parsed])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def format_grid_value(value):
+    if isinstance(value, tuple):
+        return "+".join(value)
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
+
+
+def make_preprocessor(params):
+    """Build the OCRPreprocessor for one grid point (preset first, then overrides)."""
+    params = dict(params)
+    kwargs = dict(OCR_TIERS.get(params.pop('preset', 'standard')) or {})
+    for name, value in params.items():
+        if name in ('clahe_tile', 'median_ksize', 'block_size', 'close_kernel'):
+            value = int(value)
+        kwargs[name] = value
+    return OCRPreprocessor(**kwargs)
+
+
+def load_labelled_corpus(folder, limit=None):
+    """Return [(path, key)] for the <8 digits>.pdf files in folder (e.g. pdf_output)."""
+    corpus = []
+    for name in iter_pdf_files(folder):
+        match = re.fullmatch(r'(\d{8})\.pdf', name, re.IGNORECASE)
+        if match:
+            corpus.append((os.path.join(folder, name), match.group(1)))
+            if limit and len(corpus) >= limit:
+                break
+    return corpus
+
+
+def pareto_front(results):
+    """Mark results that no other variant beats on both exact_rate and ms_per_crop."""
+    best_rate = -1.0
+    for result in sorted(results, key=lambda r: (r["ms_per_crop"], -r["exact_rate"])):
+        result["pareto"] = result["exact_rate"] > best_rate
+        best_rate = max(best_rate, result["exact_rate"])
+    return results
+
+
+def bench_sweep(repeat=1, count=None, seed=0, corpus=None, grid=DEFAULT_SWEEP_GRID, config="config.txt"):
+    """Sweep preprocessing / render-zoom variants for OCR accuracy versus cost.
+
+    The corpus is a folder of labelled PDFs named after their key (the
+    output folder works as-is) read with the OCR area from config, or a
+    synthetic corpus of count (default 40) documents when no folder is
+    given; count also caps a folder corpus. Each
+    variant renders, preprocesses and OCRs every crop (batched like the
+    batch mode); ms_per_crop is the median of repeat runs. Variants on the
+    accuracy/cost Pareto frontier get pareto=True. Needs tesseract.
+    """
+    if not tesseract_available():
+        raise SystemExit("sweep: tesseract not found")
+    root = None
+    settings = benchmark_config(config)
+    if corpus:
+        documents = load_labelled_corpus(corpus, limit=count)
+    else:
+        root = tempfile.mkdtemp(prefix="pdf_sweep_")
+        documents = make_synthetic_corpus(root, count or 40, seed=seed, config=settings)
+    engine = RenamerEngine(settings, log=lambda message: None)
+    batch_size = max(1, int(settings.get('ocr_batch_size', 50)))
+    docs = [fitz.open(path) for path, _ in documents]
+    keys = [key for _, key in documents]
+    results = []
+    try:
+        if not docs:
+            raise SystemExit(f"sweep: no <8 digits>.pdf files in {corpus}")
+        for params in parse_grid(grid):
+            label = " ".join(f"{name}={format_grid_value(value)}" for name, value in params.items())
+            stage_ms = {"render": [], "preprocess": [], "ocr": []}
+            texts = []
+            try:
+                preprocessor = make_preprocessor(params)
+                # 不正な組み合わせ（偶数のブロックサイズなど）はここで検出して記録する
+                preprocessor.process(engine.render_ocr_area(docs[0][0], preprocessor.render_zoom))
+            except (ValueError, TypeError, cv2.error) as e:
+                results.append({"bench": "sweep", "variant": label, "error": str(e).strip().splitlines()[-1]})
+                continue
+            for _ in range(repeat):
+                start = time.perf_counter()
+                raw = [engine.render_ocr_area(doc[0], preprocessor.render_zoom) for doc in docs]
+                rendered = time.perf_counter()
+                crops = [preprocessor.process(image).copy() for image in raw]
+                processed = time.perf_counter()
+                texts = []
+                for chunk in range(0, len(crops), batch_size):
+                    texts.extend(text for text, _ in engine.recognize_batch(crops[chunk:chunk + batch_size]))
+                done = time.perf_counter()
+                stage_ms["render"].append((rendered - start) * 1000.0)
+                stage_ms["preprocess"].append((processed - rendered) * 1000.0)
+                stage_ms["ocr"].append((done - processed) * 1000.0)
+            per_crop = {stage: statistics.median(samples) / len(docs) for stage, samples in stage_ms.items()}
+            exact = sum(engine.match_key(text) == key for text, key in zip(texts, keys))
+            results.append({
+                "bench": "sweep",
+                "variant": label,
+                "crops": len(docs),
+                "exact": exact,
+                "exact_rate": round(exact / len(docs), 4),
+                "ms_per_crop": round(sum(per_crop.values()), 3),
+                "render_ms": round(per_crop["render"], 3),
+                "preprocess_ms": round(per_crop["preprocess"], 3),
+                "ocr_ms": round(per_crop["ocr"], 3),
+                "signature": preprocessor.signature(),
+            })
+    finally:
+        for doc in docs:
+            doc.close()
+        engine.close()
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+    pareto_front([result for result in results if "error" not in result])
+    return results
+
+
+BENCHMARKS = {
+    "pixmap": bench_pixmap,
+    "viewer": bench_viewer,
+    "preprocess": bench_preprocess,
+    "ocr-batch": bench_ocr_batch,
+    "discovery": bench_discovery,
+    "pipeline": bench_pipeline,
+    "sweep": bench_sweep,
+}
+
+
+def environment(seed):
+    """Describe the machine and code version a result set came from."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF Renamer micro-benchmarks")
+    parser.add_argument("bench", choices=sorted(BENCHMARKS), help="benchmark to run")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (median is reported)")
+    parser.add_argument("--count", type=int, help="documents / crops to generate (benchmark default if omitted)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic data")
+    parser.add_argument("--json", help="write results as JSON to this file")
+    parser.add_argument("--corpus", help="sweep: folder of labelled <8 digits>.pdf files (e.g. pdf_output)")
+    parser.add_argument("--grid", help="sweep: parameter grid, e.g. 'render_zoom=2,4;block_size=31,45'")
+    parser.add_argument("--config", help="config file with the frame / OCR layout (default config.txt)")
+    args = parser.parse_args(argv)
+
+    bench = BENCHMARKS[args.bench]
+    options = {"repeat": args.repeat, "count": args.count, "seed": args.seed,
+               "corpus": args.corpus, "grid": args.grid, "config": args.config}
+    accepted = inspect.signature(bench).parameters
+    results = bench(**{name: value for name, value in options.items() if name in accepted and value is not None})
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"env": environment(args.seed), "results": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
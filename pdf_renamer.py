@@ -9,8 +9,2607 @@ import os
 import shutil
 from datetime import datetime
 import re
-import io
+import math
 import csv
+import json
+import sys
+import time
+import argparse
+import ctypes
+import ctypes.util
+import contextlib
+import select
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # 任意: Tesseract の C-API バインディング（常駐エンジン）
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# PyMuPDF はスレッドセーフではないため、fitz の呼び出しはこのロックで直列化する
+FITZ_LOCK = threading.RLock()
+
+
+class SpanRecorder:
+    """Per-stage latency spans, cheap enough to leave on.
+
+    ``with SPANS.span('ocr.recognize'):`` times a stage on any thread. Each
+    stage keeps its last ``keep`` durations for the p50/p95/p99 summary
+    (counts cover the whole session). Once open_file() is called, every
+    span is also appended to a JSONL file (written in batches), which
+    export_chrome_trace() turns into a chrome://tracing / Perfetto file.
+    """
+
+    FLUSH_EVERY = 256  # 溜まったイベントをまとめてファイルへ書く件数
+
+    def __init__(self, keep=2048, enabled=True):
+        self.keep = keep
+        self.enabled = enabled
+        self.path = None
+        self._lock = threading.Lock()
+        self._samples = {}  # name -> deque of durations (ms)
+        self._counts = {}
+        self._events = []
+        self._file = None
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start, args)
+
+    def add(self, name, start, duration, args=None):
+        """Record a finished span (start from time.perf_counter(), duration in seconds)."""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.keep)
+            samples.append(duration * 1000.0)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if self._file is None:
+                return
+            event = {"name": name, "ts_us": round((start - self._origin) * 1e6),
+                     "dur_us": round(duration * 1e6), "tid": thread.ident, "thread": thread.name}
+            if args:
+                event["args"] = args
+            self._events.append(event)
+            if len(self._events) >= self.FLUSH_EVERY:
+                self._write_events()
+
+    def summary(self):
+        """[(name, count, p50, p95, p99, max)] in ms, slowest p95 first."""
+        with self._lock:
+            items = [(name, self._counts[name], sorted(samples)) for name, samples in self._samples.items()]
+        rows = []
+        for name, count, values in items:
+            def pct(p):
+                return values[min(len(values) - 1, max(0, math.ceil(p / 100.0 * len(values)) - 1))]
+            rows.append((name, count, pct(50), pct(95), pct(99), values[-1]))
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows
+
+    def format_summary(self):
+        """The summary as a fixed-width text table."""
+        lines = [f"{'stage':<20}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"]
+        for name, count, p50, p95, p99, worst in self.summary():
+            lines.append(f"{name:<20}{count:>7}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{worst:>9.1f}")
+        return "\n".join(lines)
+
+    def open_file(self, path):
+        """Stream spans to path as JSON lines (kept open until close())."""
+        f = open(path, 'a', encoding='utf-8')
+        with self._lock:
+            if self._file is not None:
+                self._write_events()
+                self._file.close()
+            self._file = f
+            self.path = path
+
+    def flush(self):
+        with self._lock:
+            self._write_events()
+
+    def export_chrome_trace(self, trace_path):
+        """Convert the JSONL written so far into a Chrome trace-event file."""
+        self.flush()
+        if self.path is None:
+            return None
+        pid = os.getpid()
+        events = []
+        threads = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                threads[span["tid"]] = span.get("thread", "")
+                event = {"name": span["name"], "cat": span["name"].split('.')[0], "ph": "X",
+                         "ts": span["ts_us"], "dur": span["dur_us"], "pid": pid, "tid": span["tid"]}
+                if "args" in span:
+                    event["args"] = span["args"]
+                events.append(event)
+        for tid, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": thread_name}})
+        tmp_path = trace_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(tmp_path, trace_path)
+        return trace_path
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._write_events()
+                self._file.close()
+                self._file = None
+
+    def _write_events(self):
+        # self._lock を保持して呼ぶ
+        if self._file is None or not self._events:
+            return
+        try:
+            self._file.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in self._events))
+            self._file.flush()
+        except (OSError, ValueError):
+            pass
+        self._events.clear()
+
+
+# 処理段階ごとの所要時間（ログ出力フォルダへJSONL / Chromeトレースとして書き出し）
+SPANS = SpanRecorder()
+
+
+class RenderCache:
+    """Byte-bounded LRU cache of rasterized page images.
+
+    Keys are (file path, mtime, page number, zoom, clip rect), so an edited
+    file never serves stale pixels. Cached images are shared; callers must
+    not modify them in place.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max(0, int(max_bytes))
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (image, nbytes)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(page, zoom, clip=None):
+        path = page.parent.name
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        clip_key = tuple(round(v, 3) for v in clip) if clip is not None else None
+        return (path, mtime, page.number, float(zoom), clip_key)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, image):
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._items[key] = (image, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes and self._items:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.current_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Return a one-line summary of hit/miss counters and memory use."""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100.0) if total else 0.0
+        return (f"hit={self.hits} miss={self.misses} ({rate:.1f}%) "
+                f"{len(self._items)}件 {self.current_bytes / (1024 * 1024):.1f}MB/"
+                f"{self.max_bytes / (1024 * 1024):.0f}MB")
+
+
+def pixmap_to_pil(pix):
+    """Wrap a Pixmap's samples as a PIL image without an encode/decode round trip.
+
+    L and RGBA pixmaps share the sample memory; RGB is unpacked once by PIL.
+    The image keeps a reference to the pixmap so the buffer stays valid.
+    """
+    mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[pix.n]
+    samples = getattr(pix, 'samples_mv', None) or pix.samples
+    image = Image.frombuffer(mode, (pix.width, pix.height), samples, 'raw', mode, pix.stride, 1)
+    image._pixmap = pix
+    return image
+
+
+def pixmap_to_numpy(pix):
+    """Return an (h, w[, n]) uint8 NumPy view on a Pixmap's samples.
+
+    No pixels are copied; keep ``pix`` referenced while the view is in use.
+    """
+    samples = getattr(pix, 'samples_mv', None) or pix.samples
+    if pix.n == 1:
+        return np.ndarray((pix.height, pix.width), dtype=np.uint8, buffer=samples,
+                          strides=(pix.stride, 1))
+    return np.ndarray((pix.height, pix.width, pix.n), dtype=np.uint8, buffer=samples,
+                      strides=(pix.stride, pix.n, 1))
+
+
+def rasterize(page, zoom, clip=None, cache=None):
+    """Render page (optionally clipped) at zoom into a PIL image, via cache."""
+    key = None
+    if cache is not None:
+        key = RenderCache.make_key(page, zoom, clip)
+        image = cache.get(key)
+        if image is not None:
+            return image
+    mat = fitz.Matrix(zoom, zoom)
+    with SPANS.span('render.rasterize'):
+        if clip is not None:
+            pix = page.get_pixmap(matrix=mat, clip=fitz.Rect(clip))
+        else:
+            pix = page.get_pixmap(matrix=mat)
+        image = pixmap_to_pil(pix)
+    if cache is not None:
+        cache.put(key, image)
+    return image
+
+
+def render_viewer_image(page, canvas_width, canvas_height, cache=None, draft=None):
+    """Render the page left-half scaled to cover the canvas.
+
+    Only the part of the left half that is visible on the canvas is
+    rasterized, directly at the cover zoom (no crop/LANCZOS pass).
+    Returns (image, scale, crop_left, crop_top); the transform values keep
+    the meaning draw_frames() and on_canvas_release() expect, i.e.
+    canvas = pdf * (2.0 * scale) - crop.
+
+    With draft (0 < draft < 1) the page is rasterized at draft times the
+    zoom and stretched bilinearly to the same geometry: a quick placeholder
+    with the same transform, so frames line up. Drafts are not cached.
+    """
+    canvas_width = max(1, canvas_width)
+    canvas_height = max(1, canvas_height)
+
+    # Left half (app仕様に合わせて維持) in page coordinates
+    page_rect = page.rect
+    half_w = page_rect.width / 2
+    page_h = page_rect.height
+
+    # Cover zoom: fill the canvas while preserving aspect ratio
+    zoom = max(canvas_width / half_w, canvas_height / page_h)
+
+    # Visible region, centered in the left half
+    vis_w = canvas_width / zoom
+    vis_h = canvas_height / zoom
+    clip_x0 = max(0.0, (half_w - vis_w) / 2)
+    clip_y0 = max(0.0, (page_h - vis_h) / 2)
+    clip = (page_rect.x0 + clip_x0, page_rect.y0 + clip_y0,
+            page_rect.x0 + clip_x0 + vis_w, page_rect.y0 + clip_y0 + vis_h)
+
+    # The pixmap origin is the floored clip corner in zoomed pixels
+    left = int(clip_x0 * zoom)
+    top = int(clip_y0 * zoom)
+
+    if draft and draft < 1.0:
+        draft_zoom = zoom * draft
+        small = rasterize(page, draft_zoom, clip=clip)
+        # キャンバス左上（全解像度の画素 left, top）に当たる位置を下書き画像上で求めて引き伸ばす
+        box_x0 = max(0.0, left * draft - math.floor(clip_x0 * draft_zoom))
+        box_y0 = max(0.0, top * draft - math.floor(clip_y0 * draft_zoom))
+        box = (box_x0, box_y0, min(small.width, box_x0 + canvas_width * draft),
+               min(small.height, box_y0 + canvas_height * draft))
+        with SPANS.span('render.draft_resize'):
+            image = small.resize((canvas_width, canvas_height), Image.Resampling.BILINEAR, box=box)
+        return image, zoom / 2.0, left, top
+
+    image = rasterize(page, zoom, clip=clip, cache=cache)
+
+    # MuPDF rounds the clip outward; trim to the canvas size
+    if image.width > canvas_width or image.height > canvas_height:
+        image = image.crop((0, 0, min(image.width, canvas_width), min(image.height, canvas_height)))
+
+    return image, zoom / 2.0, left, top
+
+
+def render_area_image(page, rect, canvas_width, canvas_height, cache=None, draft=None):
+    """Render a frame area of the page fitted into a preview canvas.
+
+    The zoom is chosen so the clip rasterizes directly at display size
+    (never above the former fixed 2.0), so no resample step is needed.
+    With draft (0 < draft < 1) a low-zoom render is stretched to the same
+    size instead (not cached).
+    """
+    x0, y0, x1, y1 = rect
+    zoom = 2.0
+    if canvas_width > 1 and canvas_height > 1 and x1 > x0 and y1 > y0:
+        # MuPDF rounds the clip outward, so leave one pixel of slack
+        zoom = min(zoom, (canvas_width - 1) / (x1 - x0), (canvas_height - 1) / (y1 - y0))
+    zoom = round(zoom, 4)
+    if draft and draft < 1.0:
+        small = rasterize(page, zoom * draft, clip=rect)
+        size = (max(1, math.ceil(x1 * zoom) - math.floor(x0 * zoom)),
+                max(1, math.ceil(y1 * zoom) - math.floor(y0 * zoom)))
+        with SPANS.span('render.draft_resize'):
+            return small.resize(size, Image.Resampling.BILINEAR)
+    return rasterize(page, zoom, clip=rect, cache=cache)
+
+
+class PrefetchedPDF:
+    """An opened PDF plus the bitmaps rendered from its first page.
+
+    Each bitmap remembers the canvas size / frame rect it was rendered for,
+    so a cached one is reused only while it still fits the UI.
+    """
+
+    def __init__(self, path, doc, cache=None):
+        self.path = path
+        self.doc = doc
+        self.cache = cache
+        self._viewer = None  # (size, (image, scale, left, top))
+        self._areas = {}     # area_type -> ((rect, size), image)
+
+    def has_viewer(self, size):
+        """True if the full-quality viewer bitmap for size is ready."""
+        viewer = self._viewer
+        return viewer is not None and viewer[0] == size
+
+    def has_area(self, area_type, rect, size):
+        cached = self._areas.get(area_type)
+        return cached is not None and cached[0] == (tuple(rect), size)
+
+    def viewer_draft(self, size, draft):
+        """Return a quick low-zoom (image, scale, crop_left, crop_top); not kept."""
+        with FITZ_LOCK:
+            return render_viewer_image(self.doc[0], size[0], size[1], draft=draft)
+
+    def area_draft(self, rect, size, draft):
+        """Return a quick low-zoom preview of a frame area; not kept."""
+        with FITZ_LOCK:
+            return render_area_image(self.doc[0], rect, size[0], size[1], draft=draft)
+
+    def viewer(self, size):
+        """Return (image, scale, crop_left, crop_top) for the given canvas size."""
+        if self._viewer is None or self._viewer[0] != size:
+            with FITZ_LOCK:
+                result = render_viewer_image(self.doc[0], size[0], size[1], cache=self.cache)
+            self._viewer = (size, result)
+        return self._viewer[1]
+
+    def area(self, area_type, rect, size):
+        """Return the preview image of a frame area for the given canvas size."""
+        key = (tuple(rect), size)
+        cached = self._areas.get(area_type)
+        if cached is None or cached[0] != key:
+            with FITZ_LOCK:
+                image = render_area_image(self.doc[0], rect, size[0], size[1], cache=self.cache)
+            cached = (key, image)
+            self._areas[area_type] = cached
+        return cached[1]
+
+    def warm(self, params):
+        """Render every bitmap described by a render-parameter snapshot."""
+        viewer_size, areas = params
+        self.viewer(viewer_size)
+        for area_type, rect, size in areas:
+            self.area(area_type, rect, size)
+
+    def close(self):
+        with FITZ_LOCK:
+            try:
+                self.doc.close()
+            except Exception:
+                pass
+
+
+class PDFPrefetcher:
+    """Open and rasterize neighbouring PDFs on a background thread.
+
+    schedule() replaces the work list; entries that fall out of it are closed
+    on the worker thread, so the UI thread never waits on the fitz lock.
+    The worker never touches Tk: failures are simply not cached and the UI
+    falls back to rendering on demand (which reports the error itself).
+    """
+
+    def __init__(self, depth=2, cache=None):
+        self.depth = max(0, int(depth))
+        self.cache = cache
+        self._cond = threading.Condition()
+        self._entries = {}   # path -> PrefetchedPDF
+        self._pending = []   # paths still to render, in priority order
+        self._retired = []   # entries waiting to be closed by the worker
+        self._wanted = []
+        self._params = None
+        self._closed = False
+        self._thread = None
+
+    def schedule(self, paths, params):
+        """Prefetch the given paths (highest priority first) for params."""
+        if self.depth <= 0:
+            return
+        with self._cond:
+            if self._closed:
+                return
+            self._wanted = list(paths)
+            self._params = params
+            stale = [self._entries.pop(path) for path in list(self._entries)
+                     if path not in self._wanted]
+            self._pending = list(self._wanted)
+            self._retired.extend(stale)
+            self._start()
+            self._cond.notify()
+
+    def _start(self):
+        # 呼び出し側で self._cond を保持していること
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pdf-prefetch", daemon=True)
+            self._thread.start()
+
+    def take(self, path):
+        """Remove and return the prefetched entry for path, or None."""
+        with self._cond:
+            return self._entries.pop(path, None)
+
+    def store(self, entry):
+        """Keep a no-longer-displayed entry so stepping back is instant."""
+        with self._cond:
+            if not self._closed:
+                if self.depth > 0:
+                    old = self._entries.get(entry.path)
+                    self._entries[entry.path] = entry
+                    if old is None or old is entry:
+                        return
+                    entry = old
+                # 不要になったPDFはワーカー側で閉じる
+                self._retired.append(entry)
+                self._start()
+                self._cond.notify()
+                return
+        entry.close()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            entries = list(self._entries.values()) + self._retired
+            self._entries.clear()
+            self._pending = []
+            self._retired = []
+            self._cond.notify()
+        for entry in entries:
+            entry.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._retired and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                retired, self._retired = self._retired, []
+                path = None if retired else self._pending.pop(0)
+                params = self._params
+                entry = self._entries.get(path)
+            if retired:
+                for old in retired:
+                    old.close()
+                continue
+            created = entry is None
+            try:
+                if created:
+                    with FITZ_LOCK, SPANS.span('prefetch.open'):
+                        entry = PrefetchedPDF(path, fitz.open(path), cache=self.cache)
+                entry.warm(params)
+            except Exception:
+                if created and entry is not None:
+                    entry.close()
+                continue
+            if not created:
+                continue
+            with self._cond:
+                if self._closed or path not in self._wanted or path in self._entries:
+                    keep = False
+                else:
+                    self._entries[path] = entry
+                    keep = True
+            if not keep:
+                entry.close()
+
+class BackgroundJobs:
+    """Run slow UI work on worker threads and deliver results on the Tk thread.
+
+    Jobs are grouped in named channels ('page', 'viewer', 'areas', 'ocr');
+    each channel has one worker, so its jobs run in order and never overlap.
+    submit() bumps the channel's generation token: a job superseded before
+    it starts is skipped, and a result whose token is no longer current is
+    dropped instead of displayed (on_stale still receives it, so opened
+    documents can be handed back). With on_progress, func is called as
+    func(report) and every report(value) is delivered to on_progress ahead
+    of the final result, e.g. a draft before the sharp render; report()
+    returns False once the job is stale so long jobs can stop. poll() runs
+    the callbacks and must be called on the Tk thread; the workers never
+    touch Tk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._generations = {}
+        self._results = queue.Queue()
+        self.dropped = 0
+
+    def submit(self, channel, func, on_done, on_error=None, on_stale=None, on_progress=None):
+        """Run func() on the channel's worker; on_done(result) is called from poll()."""
+        with self._lock:
+            generation = self._generations.get(channel, 0) + 1
+            self._generations[channel] = generation
+            executor = self._executors.get(channel)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ui-{channel}")
+                self._executors[channel] = executor
+
+        def run():
+            if not self.is_current(channel, generation):
+                # 開始前に新しいジョブで置き換えられた
+                with self._lock:
+                    self.dropped += 1
+                return
+            try:
+                if on_progress is None:
+                    result = func()
+                else:
+                    def report(value):
+                        if not self.is_current(channel, generation):
+                            return False
+                        self._results.put((channel, generation, on_progress, None, None, value, None))
+                        return True
+                    result = func(report)
+                self._results.put((channel, generation, on_done, on_error, on_stale, result, None))
+            except Exception as e:
+                self._results.put((channel, generation, on_done, on_error, on_stale, None, e))
+
+        executor.submit(run)
+        return generation
+
+    def cancel(self, channel):
+        """Drop the channel's queued and running jobs' results."""
+        with self._lock:
+            self._generations[channel] = self._generations.get(channel, 0) + 1
+
+    def is_current(self, channel, generation):
+        with self._lock:
+            return self._generations.get(channel) == generation
+
+    def poll(self):
+        """Deliver finished results (Tk thread only)."""
+        while True:
+            try:
+                channel, generation, on_done, on_error, on_stale, result, error = self._results.get_nowait()
+            except queue.Empty:
+                return
+            if not self.is_current(channel, generation):
+                with self._lock:
+                    self.dropped += 1
+                if on_stale is not None and error is None:
+                    on_stale(result)
+                continue
+            if error is None:
+                on_done(result)
+            elif on_error is not None:
+                on_error(error)
+
+    def close(self):
+        """Cancel queued jobs and wait for the running ones."""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+            for channel in self._generations:
+                self._generations[channel] += 1
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# inotify のイベント（新規作成・書き込み完了・移動してきたファイル）
+IN_CREATE = 0x100
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+def open_inotify(folder):
+    """Return a non-blocking inotify fd watching folder, or None if unavailable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fd = _libc().inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if not add_inotify_watch(fd, folder):
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def add_inotify_watch(fd, folder):
+    """Also watch folder on the inotify fd; False if the watch could not be added."""
+    try:
+        return _libc().inotify_add_watch(fd, os.fsencode(folder), IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO) >= 0
+    except (OSError, AttributeError):
+        return False
+
+
+class FolderWatcher:
+    """Report PDFs that appear in a folder once they are completely written.
+
+    A background thread wakes on inotify events (Linux) or every interval
+    seconds. It rescans with os.scandir only when a watched folder's mtime
+    changed, a new file is still settling, or rescan_every seconds have
+    passed. With recursive=True subfolders (including new ones) are watched
+    too and names are relative paths, as from iter_pdf_files. A new file is
+    reported only after its size and mtime have stayed the same for settle
+    seconds, so scans still being written are skipped; a file that stays
+    empty that long is set aside (and logged) until it changes. Files in
+    known are never reported. The worker never touches Tk; collect new
+    names with poll().
+    """
+
+    def __init__(self, folder, known=(), interval=1.0, settle=2.0, rescan_every=30.0,
+                 recursive=False, log=None):
+        self.folder = folder
+        self.interval = max(0.1, float(interval))
+        self.settle = max(0.0, float(settle))
+        self.rescan_every = float(rescan_every)
+        self.recursive = recursive
+        self.log = log or (lambda message: None)
+        self.using_inotify = False
+        self._known = set(known)
+        self._candidates = {}  # name -> ((size, mtime_ns), first seen with that signature)
+        self._empty = {}  # 0バイトのまま落ち着いたファイル: name -> (size, mtime_ns)
+        self._dir_mtimes = {folder: None}  # 監視中のフォルダ -> 前回スキャン時の mtime_ns
+        self._ready = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="folder-watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def poll(self):
+        """Return the names (natural order per scan) that became ready since the last call."""
+        names = []
+        while True:
+            try:
+                names.extend(self._ready.get_nowait())
+            except queue.Empty:
+                return names
+
+    def close(self):
+        """Stop watching; the thread exits at its next wake-up (not waited for)."""
+        self._stop.set()
+
+    def _run(self):
+        fd = open_inotify(self.folder)
+        self.using_inotify = fd is not None
+        watched = {self.folder}
+        last_scan = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if self._candidates or now - last_scan >= self.rescan_every or self._changed():
+                    last_scan = now
+                    try:
+                        self._scan(now)
+                    except OSError:
+                        pass
+                    if fd is not None:
+                        for directory in self._dir_mtimes.keys() - watched:
+                            if add_inotify_watch(fd, directory):
+                                watched.add(directory)
+                self._wait(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _changed(self):
+        """True if a watched folder or a set-aside empty file changed since the last scan."""
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                if mtime is not None:
+                    return True
+        for name, signature in self._empty.items():
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                return True
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                return True
+        return False
+
+    def _wait(self, fd):
+        if fd is None:
+            self._stop.wait(self.interval)
+            return
+        readable, _, _ = select.select([fd], [], [], self.interval)
+        if readable:
+            try:
+                # イベントの中身は使わず、起床のきっかけにだけ使う
+                while os.read(fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _entries(self):
+        """Yield (relative name, DirEntry) for the PDFs under the watched folder."""
+        directories = {}
+        pending = [(self.folder, '')]
+        while pending:
+            directory, prefix = pending.pop()
+            try:
+                directories[directory] = os.stat(directory).st_mtime_ns
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.recursive:
+                                    pending.append((entry.path, prefix + entry.name + os.sep))
+                                continue
+                        except OSError:
+                            continue
+                        if entry.name.lower().endswith('.pdf'):
+                            yield prefix + entry.name, entry
+            except OSError:
+                if not prefix:
+                    raise
+        self._dir_mtimes = directories
+
+    def _scan(self, now):
+        ready = []
+        seen = set()
+        for name, entry in self._entries():
+            if name in self._known:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            seen.add(name)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if name in self._empty:
+                if self._empty[name] == signature:
+                    continue
+                # 空のまま保留していたファイルに書き込みがあった
+                del self._empty[name]
+            previous = self._candidates.get(name)
+            if previous is None or previous[0] != signature:
+                # 新規、またはまだ書き込み中（サイズ・更新日時が変化）
+                self._candidates[name] = (signature, now)
+            elif now - previous[1] >= self.settle:
+                if stat.st_size > 0:
+                    ready.append(name)
+                else:
+                    # 書き込みが中断された空ファイル: 変化するまで候補から外す
+                    del self._candidates[name]
+                    self._empty[name] = signature
+                    self.log(f"0バイトのまま変化しないPDFを保留します: {name}")
+        for pending in (self._candidates, self._empty):
+            for name in list(pending):
+                if name not in seen:
+                    del pending[name]
+        for name in ready:
+            del self._candidates[name]
+            self._known.add(name)
+        if ready:
+            # 一覧（iter_pdf_files）と同じ自然順で追加する
+            self._ready.put(sorted(ready, key=lambda name: [natural_sort_key(part) for part in name.split(os.sep)]))
+
+
+# 数値として読み込む設定項目
+INT_CONFIG_KEYS = [
+    'red_frame_x', 'red_frame_y', 'red_frame_width', 'red_frame_height',
+    'blue_frame_x', 'blue_frame_y', 'blue_frame_width', 'blue_frame_height',
+    'ocr_x', 'ocr_y', 'ocr_width', 'ocr_height',
+    'prefetch_depth', 'render_cache_mb', 'ocr_batch_size', 'ocr_multipage_tiff',
+    'ocr_cache_max_entries', 'ocr_cache_max_days', 'ocr_min_confidence',
+    'csv_compact_every', 'output_hardlink', 'watch_input_folder', 'input_recursive',
+    'ocr_image_keep', 'ocr_image_sample_every', 'ocr_png_compression',
+    'log_max_lines', 'log_flush_ms', 'trace_spans',
+]
+
+# 小数として読み込む設定項目
+FLOAT_CONFIG_KEYS = ['ocr_render_zoom', 'ocr_upscale', 'draft_scale', 'watch_settle_seconds']
+
+# OCRバックエンド: auto（tesserocrがあれば常駐エンジン）/ tesserocr / pytesseract
+OCR_BACKENDS = ('auto', 'tesserocr', 'pytesseract')
+
+# OCR画像の保存: full（全件）/ sampled（N件ごと＋要確認の読み取り）/ off
+OCR_IMAGE_MODES = ('full', 'sampled', 'off')
+
+
+def load_config_file(path='config.txt'):
+    """Load configuration from config.txt"""
+    config = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    key, value = line.strip().split('=', 1)
+                    # 数値項目の定義を新仕様に対応
+                    if key in INT_CONFIG_KEYS:
+                        config[key] = int(value)
+                    elif key in FLOAT_CONFIG_KEYS:
+                        config[key] = float(value)
+                    else:
+                        config[key] = value
+    except FileNotFoundError:
+        # Default configuration - 新仕様対応
+        config = {
+            'pdf_input_folder': 'pdf_input',
+            'pdf_output_folder': 'pdf_output',
+            'log_output_folder': 'log_output',
+            'ocr_image_folder': 'ocr_get_image',
+            # ocr_image_folderに残すOCR画像の枚数（古いものから削除、0で保存しない）
+            'ocr_image_keep': 50,
+            # OCR画像の保存: full / sampled（N件ごと＋信頼度の低い読み取り）/ off、PNG圧縮レベル（0〜9）
+            'ocr_image_mode': 'full',
+            'ocr_image_sample_every': 10,
+            'ocr_png_compression': 1,
+            # 赤枠（中央表示用）の座標
+            'red_frame_x': 600,
+            'red_frame_y': 250,
+            'red_frame_width': 300,
+            'red_frame_height': 200,
+            # 青枠（右側表示用）の座標
+            'blue_frame_x': 400,
+            'blue_frame_y': 350,
+            'blue_frame_width': 250,
+            'blue_frame_height': 150,
+            # OCR範囲（8桁+999の番号）の座標
+            'ocr_x': 600,
+            'ocr_y': 250,
+            'ocr_width': 300,
+            'ocr_height': 50,
+            # 先読みするPDFの件数（0で無効）
+            'prefetch_depth': 2,
+            # 描画キャッシュのメモリ上限（MB）
+            'render_cache_mb': 256,
+            # OCRバックエンド
+            'ocr_backend': 'auto',
+            # 一括処理で1回のTesseract実行にまとめるOCR画像数
+            'ocr_batch_size': 50,
+            # pytesseract: まとめたOCR画像を複数ページTIFFにして1回で認識（1件ずつとの一致を確認するまで既定は無効）
+            'ocr_multipage_tiff': 0,
+            # OCR結果キャッシュ（log_output/ocr_cache.sqlite3）の上限件数（0で無効）と保持日数
+            'ocr_cache_max_entries': 50000,
+            'ocr_cache_max_days': 30,
+            # OCR前処理: 描画倍率・拡大率・処理ステップ
+            'ocr_render_zoom': 4.0,
+            'ocr_upscale': 1.8,
+            'ocr_preprocess_steps': 'clahe,median,threshold,close,resize',
+            # 段階的OCR: 安い段から順に試し、信頼度と番号形式が揃った段で確定
+            # （fast の精度は未検証のため、既定は standard のみ。fast,standard,high で有効化）
+            'ocr_cascade': 'standard',
+            'ocr_min_confidence': 70,
+            # CSVログ: ジャーナルをCSVへまとめて書き出す間隔（保存回数）
+            'csv_compact_every': 100,
+            # セッション記録の保存先: csv / sqlite（WAL。CSVも同じ形式で書き出す）
+            'session_store': 'csv',
+            # 同一ドライブ上の出力をハードリンクで作成（1）。入力と出力が同じファイルになるため既定はコピー（0）
+            'output_hardlink': 0,
+            # 表示の下書き: 描画倍率に対する比率（0 = 下書きなし）
+            'draft_scale': 0.25,
+            # 入力フォルダの監視: 書き込みが止まってから追加するまでの秒数
+            'watch_input_folder': 1,
+            'watch_settle_seconds': 2.0,
+            # 入力フォルダのサブフォルダも対象にする
+            'input_recursive': 0,
+            # ログ欄に残す行数とまとめて表示する間隔（ミリ秒）
+            'log_max_lines': 1000,
+            'log_flush_ms': 200,
+            # 処理段階ごとの所要時間を記録（log_outputに .spans.jsonl / .trace.json、F12で一覧表示）
+            'trace_spans': 1
+        }
+    return config
+
+
+def configure_tesseract():
+    """Point pytesseract at a locally installed tesseract.exe if one is found."""
+    tesseract_paths = [
+        r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+        r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+        r"C:\Users\{}\AppData\Local\Programs\Tesseract-OCR\tesseract.exe".format(os.getenv('USERNAME'))
+    ]
+    
+    for path in tesseract_paths:
+        if os.path.exists(path):
+            pytesseract.pytesseract.tesseract_cmd = path
+            break
+
+
+def parse_tesseract_config(config):
+    """Split a tesseract CLI config string into (oem, psm, {variable: value})."""
+    tokens = config.split()
+    oem = psm = None
+    variables = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ('--oem', '--psm') and i + 1 < len(tokens):
+            if token == '--oem':
+                oem = int(tokens[i + 1])
+            else:
+                psm = int(tokens[i + 1])
+            i += 2
+        elif token == '-c' and i + 1 < len(tokens) and '=' in tokens[i + 1]:
+            key, value = tokens[i + 1].split('=', 1)
+            variables[key] = value
+            i += 2
+        else:
+            i += 1
+    return oem, psm, variables
+
+
+def words_to_page_results(data, page_count):
+    """Group pytesseract image_to_data output into [(text, mean_confidence)] per page.
+
+    Words keep tesseract's block/paragraph/line order; lines are joined with
+    newlines like image_to_string. Pages without words give ('', -1.0).
+    """
+    lines = {}
+    confidences = {}
+    for i, word in enumerate(data.get('text', [])):
+        word = (word or '').strip()
+        if not word:
+            continue
+        page = int(data['page_num'][i])
+        line_key = (int(data['block_num'][i]), int(data['par_num'][i]), int(data['line_num'][i]))
+        lines.setdefault(page, {}).setdefault(line_key, []).append((int(data['word_num'][i]), word))
+        try:
+            conf = float(data['conf'][i])
+        except (TypeError, ValueError):
+            conf = -1.0
+        if conf >= 0:
+            confidences.setdefault(page, []).append(conf)
+    results = []
+    for page in range(1, page_count + 1):
+        page_lines = lines.get(page, {})
+        text = '\n'.join(' '.join(w for _, w in sorted(page_lines[key])) for key in sorted(page_lines))
+        confs = confidences.get(page)
+        results.append((text, sum(confs) / len(confs) if confs else -1.0))
+    return results
+
+
+class OCRBackendError(RuntimeError):
+    """The OCR engine itself failed (e.g. tesseract is not installed), not one crop."""
+
+
+class PytesseractBackend:
+    """Run OCR through pytesseract, which starts tesseract.exe for every image.
+
+    With multipage=True recognize_batch() OCRs a whole batch in one
+    tesseract run; otherwise it runs once per crop.
+    """
+
+    name = 'pytesseract'
+
+    def __init__(self, config, lang='eng', multipage=False):
+        self.config = config
+        self.lang = lang
+        self.multipage = multipage
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, config=self.config, lang=self.lang)
+
+    def recognize(self, image):
+        """OCR one crop; returns (text, mean_confidence)."""
+        data = pytesseract.image_to_data(image, config=self.config, lang=self.lang,
+                                         output_type=pytesseract.Output.DICT)
+        return words_to_page_results(data, 1)[0]
+
+    def recognize_batch(self, images):
+        """OCR many crops with a single tesseract run.
+
+        The crops become pages of one multi-page TIFF, so every crop is still
+        recognized with the same --psm 7 line mode; words are mapped back to
+        their crop by page_num. Returns [(text, mean_confidence)] in order.
+        Without multipage each crop gets its own run (recognize()).
+        """
+        if not images:
+            return []
+        if not self.multipage:
+            return [self.recognize(image) for image in images]
+        pages = [Image.fromarray(image) if isinstance(image, np.ndarray) else image for image in images]
+        fd, tiff_path = tempfile.mkstemp(prefix='ocr_batch_', suffix='.tif')
+        os.close(fd)
+        try:
+            pages[0].save(tiff_path, save_all=True, append_images=pages[1:])
+            data = pytesseract.image_to_data(tiff_path, config=self.config, lang=self.lang,
+                                             output_type=pytesseract.Output.DICT)
+        finally:
+            try:
+                os.remove(tiff_path)
+            except OSError:
+                pass
+        return words_to_page_results(data, len(pages))
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    """Keep one Tesseract engine loaded in-process via the tesserocr C-API binding.
+
+    The model and the whitelist/psm settings are loaded once; each call only
+    hands over the pixels. Calls are serialized because a TessBaseAPI
+    instance is not thread-safe.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, config, lang='eng'):
+        oem, psm, variables = parse_tesseract_config(config)
+        kwargs = {'lang': lang, 'variables': variables}
+        # tesserocr の OEM/PSM は整数定数なので、そのまま渡せる
+        if oem is not None:
+            kwargs['oem'] = oem
+        if psm is not None:
+            kwargs['psm'] = psm
+        tessdata = self.find_tessdata()
+        if tessdata:
+            kwargs['path'] = tessdata
+        self._api = tesserocr.PyTessBaseAPI(**kwargs)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def find_tessdata():
+        """Return the tessdata folder next to the configured tesseract.exe, if any."""
+        cmd = pytesseract.pytesseract.tesseract_cmd
+        folder = os.path.join(os.path.dirname(cmd), 'tessdata') if os.path.dirname(cmd) else ''
+        return folder if folder and os.path.isdir(folder) else None
+
+    def image_to_string(self, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        with self._lock:
+            self._api.SetImage(image)
+            return self._api.GetUTF8Text()
+
+    def recognize(self, image):
+        """OCR one crop; returns (text, mean_confidence)."""
+        return self.recognize_batch([image])[0]
+
+    def recognize_batch(self, images):
+        """OCR many crops; the engine is resident, so this is a plain loop."""
+        results = []
+        with self._lock:
+            for image in images:
+                if isinstance(image, np.ndarray):
+                    image = Image.fromarray(image)
+                self._api.SetImage(image)
+                results.append((self._api.GetUTF8Text().strip(), float(self._api.MeanTextConf())))
+        return results
+
+    def close(self):
+        with self._lock:
+            self._api.End()
+
+
+def create_ocr_backend(config, name='auto', lang='eng', log=print, multipage=False):
+    """Return the OCR backend for name, falling back to pytesseract.
+
+    multipage enables pytesseract's multi-page TIFF batches.
+    """
+    if name not in OCR_BACKENDS:
+        log(f"不明なOCRバックエンド '{name}' -> auto を使用します")
+        name = 'auto'
+    if name in ('auto', 'tesserocr'):
+        if tesserocr is None:
+            if name == 'tesserocr':
+                log("tesserocr が見つかりません -> pytesseract を使用します")
+        else:
+            try:
+                return TesserocrBackend(config, lang=lang)
+            except Exception as e:
+                log(f"tesserocr 初期化エラー: {e} -> pytesseract を使用します")
+    return PytesseractBackend(config, lang=lang, multipage=multipage)
+
+
+class OCRResultCache:
+    """Persistent SQLite cache of OCR results keyed by crop content.
+
+    The key hashes the raw (pre-preprocessing) crop pixels together with a
+    parameter string describing render zoom, preprocessing and the
+    tesseract config, so any pipeline change misses the old entries.
+    Entries unused for max_days are dropped, and the table is trimmed to
+    max_entries by least recent use.
+    """
+
+    def __init__(self, path, max_entries=50000, max_days=30):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.max_days = max(0, int(max_days))
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL, digits TEXT NOT NULL,"
+            " confidence REAL NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_last_used ON ocr_cache(last_used)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(pixels, params):
+        """Hash crop pixels (NumPy array) plus the pipeline parameter string."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(params.encode('utf-8'))
+        digest.update(repr(pixels.shape).encode('ascii'))
+        digest.update(np.ascontiguousarray(pixels).data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return (text, digits, confidence) for key, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, digits, confidence FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0], row[1], row[2]
+
+    def put(self, key, text, digits, confidence):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, text, digits, confidence, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (key, text, digits, float(confidence), now, now))
+            self._conn.commit()
+            self._puts += 1
+            trim = self._puts % 500 == 0
+        if trim:
+            self.evict()
+
+    def evict(self):
+        """Drop entries older than max_days and trim to max_entries."""
+        with self._lock:
+            if self.max_days:
+                self._conn.execute("DELETE FROM ocr_cache WHERE last_used < ?",
+                                   (time.time() - self.max_days * 86400,))
+            count = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM ocr_cache WHERE key IN ("
+                    " SELECT key FROM ocr_cache ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100.0) if total else 0.0
+        return f"hit={self.hits} miss={self.misses} ({rate:.1f}%)"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OCRPreprocessor:
+    """Reusable OCR preprocessing pipeline.
+
+    The CLAHE object and morphology kernel are built once, and every step
+    writes into preallocated buffers that are reused while the crop size
+    stays the same. The returned array is therefore only valid until the
+    next process() call; copy it to keep it. Not thread-safe.
+
+    steps is an ordered subset of STEPS. render_zoom is the zoom the OCR
+    area should be rasterized at; rendering at 4.0 * 1.8 with upscale=1.0
+    skips the final resize, but is slower than the default in
+    benchmark.py preprocess.
+    """
+
+    STEPS = ('clahe', 'median', 'threshold', 'close', 'resize')
+
+    def __init__(self, steps=STEPS, render_zoom=4.0, upscale=1.8, clahe_clip=2.0, clahe_tile=8,
+                 median_ksize=3, block_size=31, threshold_c=10, close_kernel=2):
+        unknown = [step for step in steps if step not in self.STEPS]
+        if unknown:
+            raise ValueError(f"unknown preprocessing steps: {unknown}")
+        self.steps = tuple(steps)
+        self.render_zoom = float(render_zoom)
+        self.upscale = float(upscale)
+        self.clahe_clip = float(clahe_clip)
+        self.clahe_tile = int(clahe_tile)
+        self.median_ksize = int(median_ksize)
+        self.block_size = int(block_size)
+        self.threshold_c = float(threshold_c)
+        self.close_kernel = int(close_kernel)
+        self._clahe = cv2.createCLAHE(clipLimit=self.clahe_clip, tileGridSize=(self.clahe_tile, self.clahe_tile))
+        self._kernel = np.ones((self.close_kernel, self.close_kernel), np.uint8)
+        self._buffers = {}
+
+    @classmethod
+    def from_config(cls, config):
+        steps = [step.strip() for step in str(config.get('ocr_preprocess_steps', ','.join(cls.STEPS))).split(',')]
+        return cls(steps=[step for step in steps if step],
+                   render_zoom=config.get('ocr_render_zoom', 4.0),
+                   upscale=config.get('ocr_upscale', 1.8))
+
+    def signature(self):
+        """Describe the pipeline for OCR cache keys."""
+        return (f"zoom{self.render_zoom:g}/" + "+".join(self.steps) +
+                f"/clahe{self.clahe_clip:g}x{self.clahe_tile}/median{self.median_ksize}"
+                f"/gauss{self.block_size}c{self.threshold_c:g}/close{self.close_kernel}"
+                f"/resize{self.upscale:g}lanczos")
+
+    def _buffer(self, name, shape):
+        """Return a reusable uint8 buffer for (name, shape)."""
+        key = (name,) + tuple(shape)
+        buf = self._buffers.get(key)
+        if buf is None:
+            if len(self._buffers) > 32:
+                # OCR範囲の変更などでサイズが変わり続けた場合の上限
+                self._buffers.clear()
+            buf = np.empty(shape, np.uint8)
+            self._buffers[key] = buf
+        return buf
+
+    def process(self, image):
+        """Run the configured steps on a grayscale (or BGR) crop."""
+        # Convert to grayscale
+        if image.ndim == 2:
+            current = image
+        else:
+            current = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._buffer('gray', image.shape[:2]))
+        # 2つのバッファを交互に使い、入力と出力が重ならないようにする
+        ping = 0
+        for step in self.steps:
+            if step == 'resize':
+                # Resize for better OCR
+                if self.upscale == 1.0:
+                    continue
+                height, width = current.shape
+                size = (int(width * self.upscale), int(height * self.upscale))
+                dst = self._buffer('resize', (size[1], size[0]))
+                current = cv2.resize(current, size, dst=dst, interpolation=cv2.INTER_LANCZOS4)
+                continue
+            dst = self._buffer(f'work{ping}', current.shape)
+            ping ^= 1
+            if step == 'clahe':
+                # Contrast Limited Adaptive Histogram Equalization
+                current = self._clahe.apply(current, dst=dst)
+            elif step == 'median':
+                # Median blur to reduce noise
+                current = cv2.medianBlur(current, self.median_ksize, dst=dst)
+            elif step == 'threshold':
+                # Adaptive thresholding
+                current = cv2.adaptiveThreshold(current, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                cv2.THRESH_BINARY, self.block_size, self.threshold_c, dst=dst)
+            elif step == 'close':
+                # Morphological closing
+                current = cv2.morphologyEx(current, cv2.MORPH_CLOSE, self._kernel, dst=dst, iterations=1)
+        return current
+
+
+# 段階的OCR（カスケード）の各段の前処理。None は設定ファイルの前処理をそのまま使う
+OCR_TIERS = {
+    # 低解像度・二値化のみ（きれいなスキャンはここで確定させる）
+    'fast': dict(steps=('threshold',), render_zoom=2.0, upscale=1.0, block_size=15),
+    'standard': None,
+    # 高解像度で直接描画し、ノイズ除去と二値化を強めにかける
+    'high': dict(render_zoom=6.0, upscale=1.0, median_ksize=5, block_size=45, threshold_c=15, close_kernel=3),
+}
+
+
+def build_ocr_tiers(config, standard, log=print):
+    """Return [(name, OCRPreprocessor)] for the ocr_cascade config entry.
+
+    standard is the configured preprocessor, used for the 'standard' tier.
+    Unknown tier names are skipped; an empty cascade falls back to standard.
+    """
+    tiers = []
+    for name in str(config.get('ocr_cascade', 'standard')).split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in OCR_TIERS:
+            log(f"不明なOCR段階 '{name}' を無視します")
+            continue
+        settings = OCR_TIERS[name]
+        tiers.append((name, standard if settings is None else OCRPreprocessor(**settings)))
+    return tiers or [('standard', standard)]
+
+
+# 番号の取得経路（ログ表示用）
+OCR_SOURCE_LABELS = {'text': 'テキストレイヤー', 'cache': 'OCRキャッシュ', 'ocr': '画像OCR'}
+
+
+class OCRResult:
+    """The key text read from one page and how it was obtained.
+
+    source is 'text' (embedded text layer), 'cache' (OCR result cache) or
+    'ocr'; tier names the cascade tier that answered an 'ocr' result.
+    image is the preprocessed crop of that tier (None unless OCR ran), and
+    error is set instead when the page could not be read at all.
+    """
+
+    __slots__ = ('text', 'digits', 'confidence', 'source', 'tier', 'image', 'error')
+
+    def __init__(self, text='', digits='', confidence=-1.0, source='ocr', tier=None, image=None, error=None):
+        self.text = text
+        self.digits = digits
+        self.confidence = confidence
+        self.source = source
+        self.tier = tier
+        self.image = image
+        self.error = error
+
+    @property
+    def label(self):
+        label = OCR_SOURCE_LABELS[self.source]
+        if self.tier:
+            label += f"/{self.tier}"
+        if self.source != 'text' and self.confidence >= 0:
+            label += f" 信頼度{self.confidence:.0f}"
+        return label
+
+
+class OCRArtifactStore:
+    """Bounded folder of OCR debug crops: keeps the last ``keep`` images.
+
+    put() only queues a copy of the crop; PNG encoding, writing and
+    deleting happen on a background thread, so OCR never waits on the
+    disk. Which crops are saved depends on ``mode``: 'full' saves every
+    crop, 'sampled' every ``sample_every``-th one plus crops flagged as
+    doubtful, 'off' none. The written files form a ring and the oldest is
+    deleted once it is full. PNGs left over from earlier sessions are
+    removed a few at a time on the same thread.
+    """
+
+    SWEEP_BATCH = 50  # 1回の一覧取得で削除する件数（残りは次の周回で）
+    MAX_QUEUED = 64   # 書き込み待ちの上限（超えた分は保存しない）
+
+    def __init__(self, folder, keep=50, mode='full', sample_every=10, compression=1, log=print):
+        self.folder = folder
+        self.keep = max(0, int(keep))
+        if mode not in OCR_IMAGE_MODES:
+            log(f"不明なOCR画像モード '{mode}' -> full を使用します")
+            mode = 'full'
+        self.mode = mode if self.keep else 'off'
+        self.sample_every = max(1, int(sample_every))
+        self.compression = min(9, max(0, int(compression)))
+        self.log = log
+        self.dropped = 0
+        self._seen = 0
+        self._ring = OrderedDict()  # path -> None (oldest first)
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._queued = 0
+        self._thread = threading.Thread(target=self._run, name="ocr-artifacts", daemon=True)
+        self._thread.start()
+
+    def put(self, name, image, flagged=False):
+        """Queue image to be written as <folder>/<name>.png; True if it was queued.
+
+        flagged marks a doubtful read (low confidence, no key), which is
+        always kept in 'sampled' mode. The image is copied, so the caller
+        may reuse its buffer.
+        """
+        with self._lock:
+            if self.mode == 'off':
+                return False
+            self._seen += 1
+            if self.mode == 'sampled' and not flagged and (self._seen - 1) % self.sample_every:
+                return False
+            if self._queued >= self.MAX_QUEUED:
+                self.dropped += 1
+                return False
+            self._queued += 1
+        self._jobs.put((os.path.join(self.folder, f"{name}.png"), np.array(image, copy=True)))
+        return True
+
+    def paths(self):
+        """The kept images, oldest first."""
+        with self._lock:
+            return list(self._ring)
+
+    def close(self):
+        """Stop the worker after the queued writes and deletes are done."""
+        self._jobs.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _is_kept(self, path):
+        with self._lock:
+            return path in self._ring
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.log(f"OCR画像削除エラー: {e}")
+
+    def _write(self, path, image):
+        # cv2.imwriteは日本語ファイルパスをサポートしないため、エンコードしてから書き込む
+        try:
+            result, encoded_image = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+            if not result:
+                return
+            with open(path, 'wb') as f:
+                f.write(encoded_image)
+        except Exception as e:
+            self.log(f"OCR画像保存エラー: {e}")
+            return
+        evicted = []
+        with self._lock:
+            self._ring.pop(path, None)
+            self._ring[path] = None
+            while len(self._ring) > self.keep:
+                evicted.append(self._ring.popitem(last=False)[0])
+        for old_path in evicted:
+            self._remove(old_path)
+
+    def _drain(self):
+        """Handle the queued writes; False once close() was requested."""
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return True
+            if job is None:
+                self._jobs.put(None)
+                return False
+            self._handle(job)
+
+    def _handle(self, job):
+        path, image = job
+        with self._lock:
+            self._queued -= 1
+        self._write(path, image)
+
+    def _sweep(self):
+        """Delete PNGs from earlier sessions, SWEEP_BATCH per listing."""
+        while True:
+            stale = []
+            try:
+                with os.scandir(self.folder) as it:
+                    for entry in it:
+                        if (entry.name.lower().endswith('.png') and entry.is_file()
+                                and not self._is_kept(entry.path)):
+                            stale.append(entry.path)
+                            if len(stale) >= self.SWEEP_BATCH:
+                                break
+            except OSError:
+                return
+            for path in stale:
+                self._remove(path)
+            if len(stale) < self.SWEEP_BATCH:
+                return
+            # 新しい画像の書き込みを優先する
+            if not self._drain():
+                return
+
+    def _run(self):
+        if self.folder and os.path.isdir(self.folder):
+            self._sweep()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            self._handle(job)
+
+
+class RenamerEngine:
+    """UI-free OCR / rename pipeline shared by the GUI and the batch mode.
+
+    Works on the shared config dict, so frame or OCR-area changes made in the
+    GUI apply immediately. Messages go to the ``log`` callable.
+    """
+
+    # OCR configuration for digits and hyphens only
+    OCR_CONFIG = ("--oem 1 --psm 7 -c tessedit_char_whitelist=0123456789- "
+                  "-c load_system_dawg=0 -c load_freq_dawg=0")
+    # 8-digit + 999 pattern
+    KEY_PATTERN = re.compile(r'(\d{8}).*?(\d{3})')
+
+    def __init__(self, config, log=print):
+        self.config = config
+        self.log = log
+        self._ocr_backend = None
+        self._ocr_cache = None
+        self._ocr_cache_failed = False
+        self._artifacts = None
+        self.preprocessor = OCRPreprocessor.from_config(config)
+        self.ocr_tiers = build_ocr_tiers(config, self.preprocessor, log=log)
+
+    @property
+    def ocr_backend(self):
+        """The OCR backend, created on first use so startup stays fast."""
+        if self._ocr_backend is None:
+            self._ocr_backend = create_ocr_backend(
+                self.OCR_CONFIG, name=self.config.get('ocr_backend', 'auto'), log=self.log,
+                multipage=bool(self.config.get('ocr_multipage_tiff', 0)))
+            self.log(f"OCRバックエンド: {self._ocr_backend.name}")
+        return self._ocr_backend
+
+    @property
+    def ocr_cache(self):
+        """The persistent OCR result cache, or None when disabled/unavailable."""
+        if self._ocr_cache is None and not self._ocr_cache_failed:
+            max_entries = int(self.config.get('ocr_cache_max_entries', 50000))
+            if max_entries <= 0:
+                self._ocr_cache_failed = True
+                return None
+            log_dir = self.config.get('log_output_folder') or 'log_output'
+            try:
+                os.makedirs(log_dir, exist_ok=True)
+                self._ocr_cache = OCRResultCache(os.path.join(log_dir, 'ocr_cache.sqlite3'),
+                                                 max_entries=max_entries,
+                                                 max_days=self.config.get('ocr_cache_max_days', 30))
+            except Exception as e:
+                self._ocr_cache_failed = True
+                self.log(f"OCRキャッシュを開けません: {e}")
+        return self._ocr_cache
+
+    @property
+    def artifacts(self):
+        """The OCRArtifactStore for debug crops, or None without ocr_image_folder."""
+        if self._artifacts is None:
+            folder = self.config.get('ocr_image_folder')
+            if not folder:
+                return None
+            self._artifacts = OCRArtifactStore(folder, keep=self.config.get('ocr_image_keep', 50),
+                                               mode=self.config.get('ocr_image_mode', 'full'),
+                                               sample_every=self.config.get('ocr_image_sample_every', 10),
+                                               compression=self.config.get('ocr_png_compression', 1),
+                                               log=self.log)
+        return self._artifacts
+
+    def ocr_cache_params(self):
+        """Describe everything besides the pixels that decides the OCR result."""
+        tiers = "|".join(f"{name}:{preprocessor.signature()}" for name, preprocessor in self.ocr_tiers)
+        return f"{tiers};min_conf={self.min_confidence:g};{self.OCR_CONFIG};lang=eng"
+
+    @property
+    def min_confidence(self):
+        """Mean word confidence (0-100) a cascade tier needs to be accepted."""
+        return float(self.config.get('ocr_min_confidence', 70))
+
+    def close(self):
+        """Release the OCR backend (unloads a resident Tesseract engine) and the OCR cache."""
+        if self._ocr_backend is not None:
+            self._ocr_backend.close()
+            self._ocr_backend = None
+        if self._ocr_cache is not None:
+            self.log(f"OCRキャッシュ: {self._ocr_cache.stats()}")
+            self._ocr_cache.close()
+            self._ocr_cache = None
+        if self._artifacts is not None:
+            if self._artifacts.dropped:
+                self.log(f"OCR画像: 書き込みが追いつかず {self._artifacts.dropped} 件を保存しませんでした")
+            self._artifacts.close()
+            self._artifacts = None
+
+    def ocr_rect(self):
+        """Return the OCR area (PDF points) as a fitz.Rect."""
+        x = self.config.get('ocr_x', 600)
+        y = self.config.get('ocr_y', 250)
+        return fitz.Rect(x, y, x + self.config.get('ocr_width', 300), y + self.config.get('ocr_height', 50))
+
+    def extract_ocr_text(self, page, base_name=None):
+        """Read the 8-digit key from the OCR area of page; returns an OCRResult.
+
+        If base_name is given and OCR ran, the preprocessed crop is also
+        written to ocr_image_folder for inspection.
+        """
+        return self.read_pages([page], [base_name])[0]
+
+    def read_pages(self, pages, base_names=None):
+        """Read the key from the OCR area of many pages; returns [OCRResult].
+
+        Each page tries the embedded text layer, then the OCR result cache,
+        then the OCR cascade: every tier in ocr_tiers OCRs the pages still
+        open in one batch, and a page is settled by the first tier whose
+        text matches the 8-digit + 999 pattern with at least min_confidence.
+        Pages no tier accepts keep the most confident matching read, or the
+        last tier's read if none matched. If the OCR engine itself fails
+        (OCRBackendError), the cascade stops and the open pages get an error.
+        """
+        base_names = base_names or [None] * len(pages)
+        results = [None] * len(pages)
+        cache_keys = {}
+        raw = {}  # 1段目の解像度で描画したOCR範囲（キャッシュキーにも使う）
+        first_zoom = self.ocr_tiers[0][1].render_zoom
+        for i, page in enumerate(pages):
+            try:
+                # 1) PDFのテキストレイヤー（スキャナOCR済み・デジタル生成PDF）
+                text = self.read_text_layer(page)
+                if text and self.match_key(text):
+                    results[i] = OCRResult(text, self.extract_digits(text), source='text')
+                    continue
+                # 2) OCRキャッシュ（ヒットすれば前処理・OCRを省略）
+                raw[i] = self.render_ocr_area(page, first_zoom)
+                cache_keys[i], cached = self.lookup_ocr_cache(raw[i])
+                if cached is not None:
+                    results[i] = OCRResult(cached[0], cached[1], cached[2], source='cache')
+                    del raw[i]
+            except Exception as e:
+                results[i] = OCRResult(error=str(e))
+
+        # 3) 画像OCRのカスケード（安い段から順に、未確定のページだけ次の段へ）
+        pending = sorted(raw)
+        best = {}
+        for tier_index, (tier, preprocessor) in enumerate(self.ocr_tiers):
+            if not pending:
+                break
+            images = []
+            for i in list(pending):
+                try:
+                    gray_image = raw[i] if tier_index == 0 else self.render_ocr_area(pages[i], preprocessor.render_zoom)
+                    # 前処理バッファは次の呼び出しで上書きされるためコピーして保持
+                    with SPANS.span('ocr.preprocess', tier=tier):
+                        images.append(preprocessor.process(gray_image).copy())
+                except Exception as e:
+                    pending.remove(i)
+                    results[i] = best.pop(i, None) or OCRResult(error=str(e))
+            still_pending = []
+            try:
+                with SPANS.span('ocr.recognize', tier=tier, crops=len(images)):
+                    reads = self.recognize_batch(images)
+            except OCRBackendError as e:
+                # エンジン自体が使えない場合は上位の段でも同じ失敗になるので打ち切る
+                self.log(f"OCRエンジンを実行できません: {e}")
+                for i in pending:
+                    results[i] = best.pop(i, None) or OCRResult(error=str(e))
+                pending = []
+                break
+            for i, image, (text, confidence) in zip(pending, images, reads):
+                result = OCRResult(text, self.extract_digits(text), confidence, tier=tier, image=image)
+                key = self.match_key(text)
+                # 一致した中で最も信頼度の高い結果、一致がなければ最も手間をかけた段の結果
+                previous = best.get(i)
+                if (previous is None or self.match_key(previous.text) is None or
+                        key is not None and confidence > previous.confidence):
+                    best[i] = result
+                if key is not None and confidence >= self.min_confidence:
+                    results[i] = result
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+        for i in pending:
+            results[i] = best[i]
+
+        for i in raw:
+            result = results[i]
+            if result.source != 'ocr' or result.error:
+                continue
+            if result.confidence >= 0:
+                self.store_ocr_cache(cache_keys.get(i), result.text, result.digits, result.confidence)
+            if base_names[i]:
+                doubtful = self.match_key(result.text) is None or 0 <= result.confidence < self.min_confidence
+                self.save_ocr_image(base_names[i], result.image, flagged=doubtful)
+        return results
+
+    def read_text_layer(self, page):
+        """Return the embedded text inside the OCR area, in reading order ('' if none)."""
+        try:
+            with FITZ_LOCK, SPANS.span('ocr.text_layer'):
+                words = page.get_text("words", clip=self.ocr_rect())
+        except Exception as e:
+            self.log(f"テキストレイヤー読み込みエラー: {e}")
+            return ""
+        # (x0, y0, x1, y1, word, block_no, line_no, word_no)
+        words.sort(key=lambda w: (w[5], w[6], w[7]))
+        return " ".join(w[4] for w in words)
+
+    def render_ocr_area(self, page, zoom=None):
+        """Render the OCR area of page as a grayscale NumPy image.
+
+        zoom defaults to the configured preprocessor's render zoom.
+        """
+        # Extract image from OCR area, directly in grayscale
+        if zoom is None:
+            zoom = self.preprocessor.render_zoom  # High resolution for OCR
+        with FITZ_LOCK, SPANS.span('ocr.render'):
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=self.ocr_rect(),
+                                  colorspace=fitz.csGRAY, alpha=False)
+
+        # Pixmap のサンプルを直接 NumPy で参照（Pixmap解放後も使えるようコピー）
+        return pixmap_to_numpy(pix).copy()
+
+    def lookup_ocr_cache(self, gray_image):
+        """Return (cache_key, (text, digits, confidence) or None) for a raw crop.
+
+        gray_image is the OCR area rendered at the first cascade tier's zoom.
+        """
+        cache = self.ocr_cache
+        if cache is None:
+            return None, None
+        key = cache.make_key(gray_image, self.ocr_cache_params())
+        try:
+            with SPANS.span('ocr.cache_lookup'):
+                return key, cache.get(key)
+        except Exception as e:
+            self.log(f"OCRキャッシュ読み込みエラー: {e}")
+            return key, None
+
+    def store_ocr_cache(self, cache_key, text, digits, confidence):
+        if cache_key is None or self._ocr_cache is None:
+            return
+        try:
+            self._ocr_cache.put(cache_key, text, digits, confidence)
+        except Exception as e:
+            self.log(f"OCRキャッシュ書き込みエラー: {e}")
+
+    def save_ocr_image(self, base_name, image, flagged=False):
+        """Queue the preprocessed OCR crop as <base_name>_ocr.png in the artifact store.
+
+        flagged marks a doubtful read, which ocr_image_mode=sampled always keeps.
+        """
+        artifacts = self.artifacts
+        if artifacts is None:
+            return
+        # Windowsのファイルシステムエンコーディング問題を回避するための処理
+        try:
+            # エンコーディングの不整合を修正する
+            corrected_name = base_name.encode('utf-8').decode('cp932')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            corrected_name = base_name # 変換に失敗した場合は元の名前を使用
+
+        try:
+            artifacts.put(f"{corrected_name}_ocr", image, flagged=flagged)
+        except Exception as e:
+            self.log(f"OCR画像保存エラー: {e}")
+
+    def preprocess_image_for_ocr(self, image):
+        """Preprocess image for better OCR accuracy (BGR or grayscale input).
+
+        The result lives in the preprocessor's reusable buffer; copy it if it
+        must survive the next call.
+        """
+        return self.preprocessor.process(image)
+
+    def perform_ocr(self, image):
+        """Perform OCR on preprocessed image"""
+        try:
+            text = self.ocr_backend.image_to_string(image)
+            return text.strip()
+            
+        except Exception as e:
+            self.log(f"OCR実行エラー: {str(e)}")
+            return ""
+
+    def recognize_batch(self, images):
+        """Return [(text, confidence)] for many preprocessed images, in order.
+
+        Falls back to per-image perform_ocr() (confidence -1) if the batch
+        run fails. Raises OCRBackendError if the first image fails on its
+        own as well, i.e. the engine itself is unusable.
+        """
+        if not images:
+            return []
+        try:
+            if len(images) == 1:
+                text, confidence = self.ocr_backend.recognize(images[0])
+                return [(text.strip(), confidence)]
+            return [(text.strip(), confidence) for text, confidence in self.ocr_backend.recognize_batch(images)]
+        except Exception as e:
+            self.log(f"一括OCR実行エラー: {str(e)} -> 1件ずつ処理します")
+        try:
+            first = self.ocr_backend.image_to_string(images[0]).strip()
+        except Exception as e:
+            raise OCRBackendError(str(e)) from e
+        return [(first, -1.0)] + [(self.perform_ocr(image), -1.0) for image in images[1:]]
+
+    def match_key(self, text):
+        """Return the 8-digit key if text contains the 8-digit + 999 pattern, else None."""
+        # Remove all non-digit characters except hyphens
+        cleaned = re.sub(r'[^0-9-]', '', text)
+        match = self.KEY_PATTERN.search(cleaned)
+        return match.group(1) if match else None
+
+    def extract_digits(self, text):
+        """Extract 8-digit + 999 pattern from OCR text"""
+        key = self.match_key(text)
+        if key:
+            return key  # Return 8-digit part
+        
+        # Fallback: extract first 8 digits
+        digits_only = re.sub(r'[^0-9]', '', text)
+        if len(digits_only) >= 8:
+            return digits_only[:8]
+        
+        return digits_only
+
+    def output_path(self, key_value):
+        """Return the destination path <pdf_output_folder>/<key_value>.pdf."""
+        output_dir = self.config.get('pdf_output_folder') or 'pdf_output'
+        return os.path.join(output_dir, f"{key_value}.pdf")
+
+    def save_output(self, src_pdf, key_value, replace_value=None, log=None):
+        """Copy src_pdf to the output folder as <key_value>.pdf.
+
+        If replace_value names a previously saved key for the same page, that
+        older output PDF is removed once the new copy is in place. Messages
+        go to log (default self.log). Returns (destination path, copy method).
+        """
+        log = log or self.log
+        dest_pdf = self.output_path(key_value)
+        os.makedirs(os.path.dirname(dest_pdf) or '.', exist_ok=True)
+        with SPANS.span('save.copy'):
+            method = copy_output_file(src_pdf, dest_pdf, allow_link=bool(self.config.get('output_hardlink', 0)))
+        # 旧PDFの削除（既存レコードがあり、旧値が存在し、新値と異なる場合）
+        if replace_value and replace_value != key_value:
+            old_pdf_path = self.output_path(replace_value)
+            if os.path.exists(old_pdf_path):
+                try:
+                    os.remove(old_pdf_path)
+                    log(f"旧PDFを削除しました: {old_pdf_path}")
+                except Exception as de:
+                    log(f"旧PDF削除エラー: {de}")
+        return dest_pdf, method
+
+
+COPY_CHUNK = 8 * 1024 * 1024
+
+
+def _copy_file_data(src, dest):
+    """Copy file contents with the fastest available syscall; returns its name."""
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        # カーネル内コピー（Linux）: copy_file_range → sendfile
+        for name in ('copy_file_range', 'sendfile'):
+            func = getattr(os, name, None)
+            if func is None:
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if name == 'copy_file_range':
+                        sent = func(fsrc.fileno(), fdst.fileno(), COPY_CHUNK, offset, offset)
+                    else:
+                        sent = func(fdst.fileno(), fsrc.fileno(), offset, COPY_CHUNK)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError:
+                pass
+            if offset >= size:
+                return name
+            # 途中で失敗した場合は最初からやり直す
+            fdst.seek(0)
+            fdst.truncate()
+        fsrc.seek(0)
+        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+        return 'copy'
+
+
+def copy_output_file(src, dest, allow_link=True):
+    """Copy src to dest atomically; returns the method used.
+
+    The data goes to a temp file in dest's folder which is then renamed
+    over dest, so readers never see a partial PDF. On the same volume a
+    hard link is used (no data copied); otherwise copy_file_range/sendfile
+    where available, else a buffered copy. Metadata is kept as with
+    shutil.copy2.
+    """
+    folder = os.path.dirname(dest) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.pdf.tmp', dir=folder)
+    os.close(fd)
+    try:
+        method = None
+        if allow_link and hasattr(os, 'link'):
+            try:
+                if os.stat(src).st_dev == os.stat(folder).st_dev:
+                    os.remove(tmp_path)
+                    os.link(src, tmp_path)
+                    method = 'link'
+            except OSError:
+                method = None
+        if method is None:
+            method = _copy_file_data(src, tmp_path)
+            shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dest)
+        return method
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class OutputWriter:
+    """Write output PDFs on a background thread.
+
+    submit() queues RenamerEngine.save_output() and returns at once. Jobs
+    run in order on a single thread, so removing an old output and saving
+    its replacement stay ordered. The worker never touches Tk: messages
+    and the on_done / on_error callbacks are queued, and poll() delivers
+    them on the UI thread.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._jobs = queue.Queue()
+        self._messages = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}  # dest path -> queued jobs
+        self._thread = None
+
+    def submit(self, src_pdf, key_value, replace_value=None, on_done=None, on_error=None):
+        """Queue src_pdf to be saved as <key_value>.pdf; returns the destination path.
+
+        on_done(dest_pdf) runs once the file is in place, on_error(exception)
+        if the save failed (both from poll()).
+        """
+        dest_pdf = self.engine.output_path(key_value)
+        with self._lock:
+            self._pending[dest_pdf] = self._pending.get(dest_pdf, 0) + 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="output-writer", daemon=True)
+                self._thread.start()
+        self._jobs.put((src_pdf, key_value, replace_value, dest_pdf, on_done, on_error))
+        return dest_pdf
+
+    def is_pending(self, dest_pdf):
+        """True while a save to dest_pdf is queued or in progress."""
+        with self._lock:
+            return dest_pdf in self._pending
+
+    def pending_count(self):
+        with self._lock:
+            return sum(self._pending.values())
+
+    def poll(self):
+        """Run the finished jobs' callbacks; return the messages produced since the last call."""
+        messages = []
+        while True:
+            try:
+                item = self._messages.get_nowait()
+            except queue.Empty:
+                return messages
+            if isinstance(item, str):
+                messages.append(item)
+                continue
+            callback, arg = item
+            try:
+                callback(arg)
+            except Exception as e:
+                messages.append(f"保存後の処理でエラー: {e}")
+
+    def close(self):
+        """Finish the queued saves and stop the worker."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            src_pdf, key_value, replace_value, dest_pdf, on_done, on_error = job
+            start = time.perf_counter()
+            try:
+                dest_pdf, method = self.engine.save_output(src_pdf, key_value, replace_value=replace_value,
+                                                           log=self._messages.put)
+                elapsed = (time.perf_counter() - start) * 1000.0
+                self._messages.put(f"保存完了: {dest_pdf} ({method}, {elapsed:.0f}ms)")
+                if on_done is not None:
+                    self._messages.put((on_done, dest_pdf))
+            except Exception as e:
+                self._messages.put(f"保存失敗: {os.path.basename(src_pdf)} -> {os.path.basename(dest_pdf)}: {e}")
+                if on_error is not None:
+                    self._messages.put((on_error, e))
+            finally:
+                with self._lock:
+                    count = self._pending.get(dest_pdf, 1) - 1
+                    if count:
+                        self._pending[dest_pdf] = count
+                    else:
+                        self._pending.pop(dest_pdf, None)
+
+
+class LogBuffer:
+    """Thread-safe log sink: a ring of recent lines for the log pane plus a file.
+
+    write() only timestamps the message and appends it under a lock, so any
+    thread may log. The Tk thread collects the lines with take() on a
+    timer and shows them in one insert. At most max_lines unshown lines are
+    kept; older ones are counted as skipped. Every line also goes to the
+    session log file (when opened), which is flushed on each take().
+    """
+
+    def __init__(self, max_lines=1000):
+        self.max_lines = max(1, int(max_lines))
+        self._pending = deque(maxlen=self.max_lines)
+        self._skipped = 0
+        self._file = None
+        self.path = None
+        self._lock = threading.Lock()
+
+    def open_file(self, path):
+        """Also append every line to path (kept open until close())."""
+        f = open(path, 'a', encoding='utf-8')
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = f
+            self.path = path
+
+    def write(self, message):
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n"
+        with self._lock:
+            if len(self._pending) == self.max_lines:
+                self._skipped += 1
+            self._pending.append(line)
+            if self._file is not None:
+                try:
+                    self._file.write(line)
+                except (OSError, ValueError):
+                    pass
+
+    def take(self):
+        """Return (lines written since the last call, number skipped) and flush the file."""
+        with self._lock:
+            lines = list(self._pending)
+            skipped = self._skipped
+            self._pending.clear()
+            self._skipped = 0
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                except (OSError, ValueError):
+                    pass
+        return lines, skipped
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SessionLog:
+    """The per-run CSV log kept as an in-memory index of rows.
+
+    Row n (1-based) is the record for page n: [key, placeholder, seq] as
+    strings, exactly what csv.reader returns for the CSV file. Lookups and
+    saves are O(1): each change is appended as one JSON line to
+    <csv_path>.journal, and compact() rewrites the CSV from memory and
+    empties the journal every compact_every changes and on close(). On
+    open, the CSV and any journal left by an unclean exit are replayed.
+    """
+
+    def __init__(self, csv_path, compact_every=100, log=print):
+        self.csv_path = csv_path
+        self.journal_path = csv_path + '.journal'
+        self.compact_every = max(1, int(compact_every))
+        self.log = log
+        self.rows = []
+        self._pending = 0
+        self._journal = None
+        try:
+            if os.path.exists(csv_path):
+                with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+                    self.rows = list(csv.reader(f))
+            if os.path.exists(self.journal_path):
+                replayed = self._replay()
+                if replayed:
+                    self.log(f"CSVジャーナルを復元しました: {replayed}件")
+                    self.compact()
+        except Exception as e:
+            self.log(f"CSV読み込みエラー: {e}")
+
+    @classmethod
+    def recover_folder(cls, folder, log=print):
+        """Compact journals left in folder by sessions that did not close cleanly."""
+        try:
+            names = [name for name in os.listdir(folder) if name.endswith('.csv.journal')]
+        except OSError:
+            return
+        for name in names:
+            cls(os.path.join(folder, name[:-len('.journal')]), log=log).close()
+
+    def _replay(self):
+        replayed = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._set(int(record['index']), [str(value) for value in record['row']])
+                    replayed += 1
+                except (ValueError, KeyError, TypeError):
+                    # 書き込み途中で終了した最終行などは無視
+                    continue
+        return replayed
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, index_1based):
+        """Return the row at 1-based index, or None."""
+        if 1 <= index_1based <= len(self.rows):
+            return self.rows[index_1based - 1]
+        return None
+
+    def last_seq(self):
+        """Return the seq of the last row that has one (0 if none)."""
+        for row in reversed(self.rows):
+            if not row:
+                continue
+            try:
+                # Use the last column as seq to support both 2-col and 3-col historical formats
+                return int(row[-1])
+            except ValueError:
+                continue
+        return 0
+
+    def append(self, key_value, placeholder_text, source_file=None):
+        """Append [key_value, placeholder_text, last seq + 1]; returns (index, seq).
+
+        source_file is accepted for SQLiteSessionLog compatibility; the CSV
+        layout has no column for it.
+        """
+        seq = self.last_seq() + 1
+        index = len(self.rows) + 1
+        self._write(index, [key_value, placeholder_text, str(seq)])
+        return index, seq
+
+    def update(self, index_1based, key_value, placeholder_text, keep_seq=None, source_file=None):
+        """Replace the row at 1-based index, keeping keep_seq or its old seq.
+
+        Returns False (and changes nothing) if the row does not exist.
+        """
+        old_row = self.get(index_1based)
+        if old_row is None:
+            return False
+        seq_val = keep_seq
+        if seq_val is None:
+            try:
+                seq_val = int(old_row[-1])
+            except (ValueError, IndexError):
+                seq_val = index_1based  # フォールバック
+        self._write(index_1based, [key_value, placeholder_text, str(seq_val)])
+        return True
+
+    def _set(self, index_1based, row):
+        if index_1based == len(self.rows) + 1:
+            self.rows.append(row)
+        elif 1 <= index_1based <= len(self.rows):
+            self.rows[index_1based - 1] = row
+        else:
+            raise ValueError(f"row index out of range: {index_1based}")
+
+    def _write(self, index_1based, row):
+        """Journal one change, then apply it in memory."""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps({'index': index_1based, 'row': row}, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        self._set(index_1based, row)
+        self._pending += 1
+        if self._pending >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the CSV from memory and empty the journal."""
+        tmp_path = self.csv_path + '.tmp'
+        with SPANS.span('csv.compact', rows=len(self.rows)):
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerows(self.rows)
+            os.replace(tmp_path, self.csv_path)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._pending = 0
+
+    def close(self):
+        """Compact any journaled changes into the CSV (creating it if missing)."""
+        if self._pending or self._journal is not None or not os.path.exists(self.csv_path):
+            self.compact()
+
+
+class SQLiteSessionLog:
+    """SessionLog backed by a SQLite database in WAL mode.
+
+    One database (log_output/session_log.sqlite3) holds every run: a
+    `sessions` row per CSV name and a `session_rows` row per page, with the
+    source file name, key, lookup result, seq and timestamps, indexed by
+    (session, page) and by key. Each save is a single-row transaction.
+    export_csv() writes the run in the CSV layout, byte for byte what
+    SessionLog would write, every export_every saves and on close() so
+    tools reading the CSV keep working.
+    """
+
+    def __init__(self, db_path, csv_path, export_every=100, log=print):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.export_every = max(1, int(export_every))
+        self.log = log
+        self._pending = 0
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, csv_path TEXT NOT NULL, started REAL NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_rows ("
+                " session_id INTEGER NOT NULL, page INTEGER NOT NULL, source_file TEXT,"
+                " key TEXT NOT NULL, result TEXT NOT NULL, seq INTEGER NOT NULL,"
+                " created REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (session_id, page))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS session_rows_key ON session_rows(key)")
+            name = os.path.basename(csv_path)
+            self._conn.execute("INSERT OR IGNORE INTO sessions (name, csv_path, started) VALUES (?, ?, ?)",
+                               (name, csv_path, time.time()))
+        self.session_id = self._conn.execute("SELECT id FROM sessions WHERE name = ?", (name,)).fetchone()[0]
+        self._count = self._conn.execute(
+            "SELECT COUNT(*) FROM session_rows WHERE session_id = ?", (self.session_id,)).fetchone()[0]
+
+    def __len__(self):
+        return self._count
+
+    def get(self, index_1based):
+        """Return the row at 1-based index as [key, result, seq] strings, or None."""
+        row = self._conn.execute(
+            "SELECT key, result, seq FROM session_rows WHERE session_id = ? AND page = ?",
+            (self.session_id, index_1based)).fetchone()
+        return [row[0], row[1], str(row[2])] if row else None
+
+    def last_seq(self):
+        """Return the seq of the last row (0 if none)."""
+        row = self._conn.execute(
+            "SELECT seq FROM session_rows WHERE session_id = ? ORDER BY page DESC LIMIT 1",
+            (self.session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def append(self, key_value, placeholder_text, source_file=None):
+        """Append [key_value, placeholder_text, last seq + 1]; returns (index, seq)."""
+        now = time.time()
+        with self._conn:
+            seq = self.last_seq() + 1
+            index = self._count + 1
+            self._conn.execute(
+                "INSERT INTO session_rows (session_id, page, source_file, key, result, seq, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.session_id, index, source_file, key_value, placeholder_text, seq, now, now))
+        self._count = index
+        self._saved()
+        return index, seq
+
+    def update(self, index_1based, key_value, placeholder_text, keep_seq=None, source_file=None):
+        """Replace the row at 1-based index, keeping keep_seq or its old seq.
+
+        Returns False (and changes nothing) if the row does not exist.
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE session_rows SET key = ?, result = ?, seq = COALESCE(?, seq),"
+                " source_file = COALESCE(?, source_file), updated = ?"
+                " WHERE session_id = ? AND page = ?",
+                (key_value, placeholder_text, keep_seq, source_file, time.time(), self.session_id, index_1based))
+        if cursor.rowcount == 0:
+            return False
+        self._saved()
+        return True
+
+    def _saved(self):
+        self._pending += 1
+        if self._pending >= self.export_every:
+            self.export_csv()
+
+    def export_csv(self, path=None):
+        """Write this run in the CSV layout (key, result, seq per page) to path or csv_path."""
+        path = path or self.csv_path
+        rows = self._conn.execute(
+            "SELECT key, result, seq FROM session_rows WHERE session_id = ? ORDER BY page",
+            (self.session_id,))
+        tmp_path = path + '.tmp'
+        with SPANS.span('csv.export'):
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerows(rows)
+            os.replace(tmp_path, path)
+        self._pending = 0
+
+    def close(self):
+        """Export the CSV and close the database."""
+        try:
+            self.export_csv()
+        finally:
+            self._conn.close()
+
+
+# セッション記録の保存先
+SESSION_STORES = ('csv', 'sqlite')
+
+
+def open_session_log(config, csv_path, log=print):
+    """Open the session log for csv_path using the session_store config entry.
+
+    'sqlite' keeps the rows in log_output/session_log.sqlite3 and exports
+    the CSV; it falls back to the plain CSV log if the database can't be
+    opened.
+    """
+    store = config.get('session_store', 'csv')
+    every = config.get('csv_compact_every', 100)
+    if store == 'sqlite':
+        try:
+            return SQLiteSessionLog(os.path.join(os.path.dirname(csv_path) or '.', 'session_log.sqlite3'),
+                                    csv_path, export_every=every, log=log)
+        except Exception as e:
+            log(f"セッションDBを開けません: {e} -> CSVに記録します")
+    elif store not in SESSION_STORES:
+        log(f"不明なsession_store '{store}' -> csv を使用します")
+    return SessionLog(csv_path, compact_every=every, log=log)
+
+
+_NATURAL_SPLIT = re.compile(r'(\d+)')
+
+
+def natural_sort_key(name):
+    """Sort key placing 'scan_9' before 'scan_10' (case-insensitive)."""
+    # split() は文字列と数字列を交互に返すので、奇数番目だけ数値にする
+    parts = _NATURAL_SPLIT.split(name.lower())
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+
+# 一括キー用: ASCIIの数字列と、ASCII以外の数字（全角数字など）
+_NATURAL_RUN = re.compile(r'[0-9]+')
+_NATURAL_WIDE_DIGIT = re.compile(r'[^\D0-9]')
+
+
+def _pad_digits(match):
+    run = match.group()
+    if len(run) > 20:
+        raise ValueError(run)
+    # \x01 は数字列を後続の文字より前に並べる（natural_sort_key で文字列部分が短い方が先になるのと同じ）
+    return '\x01' + run.rjust(20, '0')
+
+
+def natural_sort_keys(names):
+    """Return string keys ordering names like natural_sort_key, computed in bulk.
+
+    The names are joined and every digit run is zero-padded in one regex
+    pass, which is about 3x faster than calling natural_sort_key per name
+    on a large folder. Names with non-ASCII digits or runs longer than 20
+    digits fall back to natural_sort_key.
+    """
+    if not names:
+        return []
+    joined = '\0'.join(names).lower()
+    if '\x01' not in joined and (joined.isascii() or not _NATURAL_WIDE_DIGIT.search(joined)):
+        try:
+            return _NATURAL_RUN.sub(_pad_digits, joined).split('\0')
+        except ValueError:
+            pass  # 21桁以上の数字列
+    return [natural_sort_key(name) for name in names]
+
+
+def iter_pdf_files(folder, recursive=False):
+    """Yield PDF paths relative to folder in natural order, lazily.
+
+    Each directory is listed once with os.scandir and ordered on its own
+    (natural_sort_keys), and with recursive=True subfolders are visited in
+    place (depth first), so the output is in natural order of the whole
+    relative path. The first entry of a directory is picked with a single
+    min() pass and yielded before the rest of the listing is sorted, so a
+    large flat folder shows its first PDF without waiting for the sort.
+    Symlinked folders are not followed.
+    """
+    def walk(directory, prefix):
+        names = []
+        is_dirs = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    name = entry.name
+                    try:
+                        if name.lower().endswith('.pdf') and not entry.is_dir(follow_symlinks=False):
+                            is_dir = False
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            is_dir = True
+                        else:
+                            continue
+                    except OSError:
+                        continue
+                    names.append(name)
+                    is_dirs.append(is_dir)
+        except OSError:
+            if prefix:
+                return  # 読めないサブフォルダは飛ばす
+            raise
+        entries = list(zip(natural_sort_keys(names), names, is_dirs))
+        for _, name, is_dir in ordered(entries):
+            if is_dir:
+                yield from walk(os.path.join(directory, name), prefix + name + os.sep)
+            else:
+                yield prefix + name
+
+    def ordered(entries):
+        if not entries:
+            return
+        # 先頭だけ先に返し、残りの並べ替えは次の要求まで遅らせる
+        yield min(entries)
+        entries.sort()
+        yield from entries[1:]
+
+    return walk(folder, '')
+
+
+def list_pdf_files(folder, recursive=False):
+    """Return the PDF paths in folder (relative, natural order)."""
+    return list(iter_pdf_files(folder, recursive=recursive))
+
+
+def run_batch(input_folder, output_folder, unresolved_folder=None, config=None, log=print):
+    """OCR, rename and log a whole folder without the Tk UI.
+
+    A document is saved as <key>.pdf only when its OCR text matches the
+    8-digit + 999 pattern and the output name is still free; anything else is
+    copied to unresolved_folder (if given) so it can be finished in the GUI.
+    Rows go to a new log_output/YYYYMMDD_hhmmss.csv in the GUI's CSV layout.
+    Returns (processed, resolved, elapsed_seconds).
+    """
+    config = dict(config if config is not None else load_config_file())
+    config['pdf_input_folder'] = input_folder
+    config['pdf_output_folder'] = output_folder
+    engine = RenamerEngine(config, log=log)
+
+    log_dir = config.get('log_output_folder') or 'log_output'
+    for folder in (output_folder, log_dir, config.get('ocr_image_folder'), unresolved_folder):
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+    csv_path = os.path.join(log_dir, datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv")
+
+    pdf_files = list_pdf_files(input_folder, recursive=bool(config.get('input_recursive', 0)))
+    log(f"{len(pdf_files)}個のPDFファイルを一括処理します: {input_folder}")
+
+    batch_size = max(1, int(config.get('ocr_batch_size', 50)))
+    total = len(pdf_files)
+    resolved = 0
+    used_keys = set()
+    tier_counts = {}  # 画像OCRで番号が読めた段ごとの件数
+    session_base = os.path.splitext(csv_path)[0]
+    SPANS.enabled = bool(config.get('trace_spans', 1))
+    if SPANS.enabled:
+        SPANS.open_file(session_base + '.spans.jsonl')
+    start = time.perf_counter()
+    session_log = open_session_log(config, csv_path, log=log)
+    try:
+        for chunk_start in range(0, total, batch_size):
+            # 1) チャンク内のPDFを開く（カスケードの上位段で再描画するため読み取りが終わるまで保持）
+            jobs = []  # [number, name, src_pdf, doc, error]
+            for number, name in enumerate(pdf_files[chunk_start:chunk_start + batch_size], start=chunk_start + 1):
+                src_pdf = os.path.join(input_folder, name)
+                try:
+                    with FITZ_LOCK:
+                        doc = fitz.open(src_pdf)
+                    jobs.append([number, name, src_pdf, doc, None])
+                except Exception as e:
+                    jobs.append([number, name, src_pdf, None, f"処理エラー: {e}"])
+
+            # 2) まとめて読み取り（テキストレイヤー → キャッシュ → 段ごとに一括OCR）
+            opened = [job for job in jobs if job[3] is not None]
+            result_by_number = {}
+            try:
+                results = engine.read_pages([job[3][0] for job in opened],
+                                            [os.path.splitext(os.path.basename(job[1]))[0] for job in opened])
+                for job, result in zip(opened, results):
+                    result_by_number[job[0]] = result
+                    if result.error:
+                        job[4] = f"処理エラー: {result.error}"
+                    elif result.tier and engine.match_key(result.text) is not None:
+                        tier_counts[result.tier] = tier_counts.get(result.tier, 0) + 1
+            except Exception as e:
+                for job in opened:
+                    job[4] = f"処理エラー: {e}"
+            finally:
+                with FITZ_LOCK:
+                    for job in opened:
+                        job[3].close()
+
+            # 3) 判定・保存
+            for number, name, src_pdf, _, reason in jobs:
+                key = None
+                if reason is None:
+                    text = result_by_number[number].text
+                    key = engine.match_key(text)
+                    if key is None:
+                        reason = f"8桁+999が見つかりません (OCR結果: {text!r})"
+                    elif key in used_keys or os.path.exists(engine.output_path(key)):
+                        reason = f"出力ファイルが既に存在します: {key}.pdf"
+                        key = None
+
+                if key is not None:
+                    try:
+                        dest_pdf, _ = engine.save_output(src_pdf, key)
+                        used_keys.add(key)
+                        resolved += 1
+                        session_log.append(key, "", source_file=name)
+                        log(f"[{number}/{total}] {name} -> {dest_pdf} ({result_by_number[number].label})")
+                        continue
+                    except Exception as e:
+                        reason = f"コピー中にエラー: {e}"
+
+                log(f"[{number}/{total}] 未解決: {name} ({reason})")
+                if unresolved_folder:
+                    try:
+                        unresolved_pdf = os.path.join(unresolved_folder, name)
+                        os.makedirs(os.path.dirname(unresolved_pdf), exist_ok=True)
+                        shutil.copy2(src_pdf, unresolved_pdf)
+                    except Exception as e:
+                        log(f"未解決フォルダへのコピーエラー: {e}")
+    finally:
+        session_log.close()
+        engine.close()
+
+    elapsed = time.perf_counter() - start
+    processed = len(pdf_files)
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    log(f"CSVログファイル: {csv_path}")
+    if tier_counts:
+        log("OCR段階: " + ", ".join(f"{tier}={tier_counts.get(tier, 0)}" for tier, _ in engine.ocr_tiers))
+    log(f"完了: {processed}件 (解決 {resolved} / 未解決 {processed - resolved}) "
+        f"{elapsed:.1f}秒, {rate:.2f} docs/sec")
+    if SPANS.enabled:
+        log("処理時間:\n" + SPANS.format_summary())
+        log(f"トレース: {SPANS.export_chrome_trace(session_base + '.trace.json')}")
+        SPANS.close()
+    return processed, resolved, elapsed
+
 
 class PDFRenamerApp:
     def __init__(self, root):
@@ -20,6 +2619,14 @@ class PDFRenamerApp:
         
         # Configuration
         self.config = self.load_config()
+        # ログは一定間隔でまとめてログ欄へ表示し、全行をセッションのログファイルへ
+        self.log_buffer = LogBuffer(self.config.get('log_max_lines', 1000))
+        # UI非依存のOCR/保存処理（一括処理モードと共通）
+        self.engine = RenamerEngine(self.config, log=self.log_message)
+        # 出力PDFの書き込みはバックグラウンドで行い、結果はログ欄へ
+        self.output_writer = OutputWriter(self.engine)
+        # 書き込み待ちの保存: page_no -> {'value', 'placeholder', 'seq'}（CSVに記録される前の値）
+        self.pending_saves = {}
         
         # Variables - 新仕様対応
         self.pdf_files = []
@@ -34,9 +2641,22 @@ class PDFRenamerApp:
         self._render_scale = 1.0
         self._crop_left = 0
         self._crop_top = 0
+        # 表示中PDFのドキュメントと描画済みビットマップ
+        self._current_entry = None
+        # ラスタライズ結果のLRUキャッシュ（メモリ上限はMB指定）
+        self.render_cache = RenderCache(self.config.get('render_cache_mb', 256) * 1024 * 1024)
+        # 次/前のPDFをバックグラウンドで先読み
+        self.prefetcher = PDFPrefetcher(self.config.get('prefetch_depth', 2), cache=self.render_cache)
+        # PDFの読み込み・描画・OCRはワーカースレッドで行い、結果はTkスレッドで表示
+        self.jobs = BackgroundJobs()
+        # 入力フォルダに届いた新しいPDFを作業リストへ追加
+        self.folder_watcher = None
+        self._discovering = False
         
         # Create folders
         self.create_folders()
+        # 前回までのOCR画像はここで作るストアがバックグラウンドで片付ける
+        _ = self.engine.artifacts
 
         # Prepare per-run CSV log file name (YYYYMMDD_hhmmss.csv)
         try:
@@ -66,6 +2686,20 @@ class PDFRenamerApp:
                 # 最終手段: メモリ上のパス（起動後の保存時に例外で通知）
                 self.current_csv_path = os.path.join(os.getcwd(), ts_name)
                 print(f"CSV作成に失敗しました: {e2}")
+        # ログの全文はCSVと同じ名前の .log へ
+        session_base = os.path.splitext(self.current_csv_path)[0]
+        try:
+            self.log_buffer.open_file(session_base + '.log')
+        except Exception as e:
+            print(f"ログファイル作成エラー: {e}")
+        # 処理段階ごとの所要時間は .spans.jsonl へ（終了時にChromeトレースも書き出す）
+        SPANS.enabled = bool(self.config.get('trace_spans', 1))
+        self._span_summary = None
+        if SPANS.enabled:
+            try:
+                SPANS.open_file(session_base + '.spans.jsonl')
+            except Exception as e:
+                print(f"トレースファイル作成エラー: {e}")
 
         # Setup UI
         self.setup_ui()
@@ -74,6 +2708,14 @@ class PDFRenamerApp:
             self.log_message(f"CSVログファイル: {self.current_csv_path}")
         except Exception:
             pass
+        # CSVログはメモリ上で行番号から引き、変更はジャーナルへ追記
+        SessionLog.recover_folder(os.path.dirname(self.current_csv_path) or '.', log=self.log_message)
+        self.session_log = open_session_log(self.config, self.current_csv_path, log=self.log_message)
+        self.root.after(100, self.poll_output_writer)
+        self.root.after(20, self.poll_background_jobs)
+        self.root.after(self.config.get('log_flush_ms', 200), self.flush_log_pane)
+        # F12: 処理段階ごとの所要時間（p50/p95/p99）を表示／非表示
+        self.root.bind('<F12>', self.toggle_span_summary)
         
         # Setup Tesseract path
         self.setup_tesseract()
@@ -83,37 +2725,7 @@ class PDFRenamerApp:
     
     def load_config(self):
         """Load configuration from config.txt"""
-        config = {}
-        try:
-            with open('config.txt', 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip() and not line.startswith('#'):
-                        key, value = line.strip().split('=', 1)
-                        # 数値項目の定義を新仕様に対応
-                        if key in ['red_frame_x', 'red_frame_y', 'red_frame_width', 'red_frame_height',
-                                  'blue_frame_x', 'blue_frame_y', 'blue_frame_width', 'blue_frame_height']:
-                            config[key] = int(value)
-                        else:
-                            config[key] = value
-        except FileNotFoundError:
-            # Default configuration - 新仕様対応
-            config = {
-                'pdf_input_folder': 'pdf_input',
-                'pdf_output_folder': 'pdf_output',
-                'log_output_folder': 'log_output',
-                'ocr_image_folder': 'ocr_get_image',
-                # 赤枠（中央表示用）の座標
-                'red_frame_x': 600,
-                'red_frame_y': 250,
-                'red_frame_width': 300,
-                'red_frame_height': 200,
-                # 青枠（右側表示用）の座標
-                'blue_frame_x': 400,
-                'blue_frame_y': 350,
-                'blue_frame_width': 250,
-                'blue_frame_height': 150
-            }
-        return config
+        return load_config_file()
     
     def save_config(self):
         """Save configuration to config.txt"""
@@ -123,6 +2735,12 @@ class PDFRenamerApp:
             f.write(f"pdf_output_folder={self.config['pdf_output_folder']}\n")
             f.write(f"log_output_folder={self.config['log_output_folder']}\n")
             f.write(f"ocr_image_folder={self.config['ocr_image_folder']}\n")
+            f.write("\n# OCR debug crops kept in ocr_image_folder, oldest deleted first (0 = do not save)\n")
+            f.write(f"ocr_image_keep={self.config.get('ocr_image_keep', 50)}\n")
+            f.write("\n# OCR crops saved: full / sampled (every Nth plus doubtful reads) / off; PNG compression 0-9\n")
+            f.write(f"ocr_image_mode={self.config.get('ocr_image_mode', 'full')}\n")
+            f.write(f"ocr_image_sample_every={self.config.get('ocr_image_sample_every', 10)}\n")
+            f.write(f"ocr_png_compression={self.config.get('ocr_png_compression', 1)}\n")
             f.write("\n# Red Frame Coordinates (Center Display Area)\n")
             f.write(f"red_frame_x={self.config.get('red_frame_x', 600)}\n")
             f.write(f"red_frame_y={self.config.get('red_frame_y', 250)}\n")
@@ -133,6 +2751,49 @@ class PDFRenamerApp:
             f.write(f"blue_frame_y={self.config.get('blue_frame_y', 350)}\n")
             f.write(f"blue_frame_width={self.config.get('blue_frame_width', 250)}\n")
             f.write(f"blue_frame_height={self.config.get('blue_frame_height', 150)}\n")
+            f.write("\n# OCR Area (8-digit + 999 number)\n")
+            f.write(f"ocr_x={self.config.get('ocr_x', 600)}\n")
+            f.write(f"ocr_y={self.config.get('ocr_y', 250)}\n")
+            f.write(f"ocr_width={self.config.get('ocr_width', 300)}\n")
+            f.write(f"ocr_height={self.config.get('ocr_height', 50)}\n")
+            f.write("\n# OCR backend: auto / tesserocr (resident engine) / pytesseract\n")
+            f.write(f"ocr_backend={self.config.get('ocr_backend', 'auto')}\n")
+            f.write("\n# Crops recognized per tesseract run in batch mode\n")
+            f.write(f"ocr_batch_size={self.config.get('ocr_batch_size', 50)}\n")
+            f.write("\n# pytesseract: one multi-page TIFF run per batch (1) or one run per crop (0)\n")
+            f.write(f"ocr_multipage_tiff={self.config.get('ocr_multipage_tiff', 0)}\n")
+            f.write("\n# Persistent OCR result cache (0 entries = off)\n")
+            f.write(f"ocr_cache_max_entries={self.config.get('ocr_cache_max_entries', 50000)}\n")
+            f.write(f"ocr_cache_max_days={self.config.get('ocr_cache_max_days', 30)}\n")
+            f.write("\n# OCR preprocessing (render zoom, final upscale, step list)\n")
+            f.write(f"ocr_render_zoom={self.config.get('ocr_render_zoom', 4.0)}\n")
+            f.write(f"ocr_upscale={self.config.get('ocr_upscale', 1.8)}\n")
+            f.write(f"ocr_preprocess_steps={self.config.get('ocr_preprocess_steps', 'clahe,median,threshold,close,resize')}\n")
+            f.write("\n# OCR cascade tiers (standard only, or e.g. fast,standard,high) and minimum confidence to accept a tier\n")
+            f.write(f"ocr_cascade={self.config.get('ocr_cascade', 'standard')}\n")
+            f.write(f"ocr_min_confidence={self.config.get('ocr_min_confidence', 70)}\n")
+            f.write("\n# Session CSV: saves journaled between full CSV rewrites\n")
+            f.write(f"csv_compact_every={self.config.get('csv_compact_every', 100)}\n")
+            f.write("\n# Session store: csv or sqlite (log_output/session_log.sqlite3, CSV exported)\n")
+            f.write(f"session_store={self.config.get('session_store', 'csv')}\n")
+            f.write("\n# Hard-link output PDFs on the same volume instead of copying (input and output then share one file; 0 = copy)\n")
+            f.write(f"output_hardlink={self.config.get('output_hardlink', 0)}\n")
+            f.write("\n# Draft preview zoom relative to the full render, shown until it is ready (0 = off)\n")
+            f.write(f"draft_scale={self.config.get('draft_scale', 0.25)}\n")
+            f.write("\n# Watch pdf_input for new scans (0 = off); seconds a file must stay unchanged before it is added\n")
+            f.write(f"watch_input_folder={self.config.get('watch_input_folder', 1)}\n")
+            f.write(f"watch_settle_seconds={self.config.get('watch_settle_seconds', 2.0)}\n")
+            f.write("\n# Include PDFs in subfolders of pdf_input (1 = on)\n")
+            f.write(f"input_recursive={self.config.get('input_recursive', 0)}\n")
+            f.write("\n# Log pane: lines kept on screen and refresh interval in ms (full log in log_output/<session>.log)\n")
+            f.write(f"log_max_lines={self.config.get('log_max_lines', 1000)}\n")
+            f.write(f"log_flush_ms={self.config.get('log_flush_ms', 200)}\n")
+            f.write("\n# Per-stage timing spans (log_output/<session>.spans.jsonl and .trace.json, F12 shows p50/p95/p99)\n")
+            f.write(f"trace_spans={self.config.get('trace_spans', 1)}\n")
+            f.write("\n# Number of upcoming PDFs rendered in the background (0 = off)\n")
+            f.write(f"prefetch_depth={self.config.get('prefetch_depth', 2)}\n")
+            f.write("\n# Memory budget of the rendered page cache in MB\n")
+            f.write(f"render_cache_mb={self.config.get('render_cache_mb', 256)}\n")
     
     def create_folders(self):
         """Create necessary folders"""
@@ -147,16 +2808,7 @@ class PDFRenamerApp:
     
     def setup_tesseract(self):
         """Setup Tesseract path"""
-        tesseract_paths = [
-            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-            r"C:\Users\{}\AppData\Local\Programs\Tesseract-OCR\tesseract.exe".format(os.getenv('USERNAME'))
-        ]
-        
-        for path in tesseract_paths:
-            if os.path.exists(path):
-                pytesseract.pytesseract.tesseract_cmd = path
-                break
+        configure_tesseract()
     
     def setup_ui(self):
         """Setup the user interface - 新仕様3分割レイアウト"""
@@ -420,6 +3072,11 @@ class PDFRenamerApp:
     
     def on_save_click(self):
         """Copy the currently viewed PDF to output folder with Entry value as filename."""
+        with SPANS.span('save.click'):
+            self.save_current_pdf()
+
+    def save_current_pdf(self):
+        """Validate the entry, queue the output copy and record the page in the session CSV."""
         # 1) Validate entry
         value = self.entry_var.get().strip() if hasattr(self, 'entry_var') else ""
         if not (len(value) == 8 and value.isdigit()):
@@ -451,59 +3108,82 @@ class PDFRenamerApp:
             messagebox.showerror("エラー", f"出力フォルダの作成に失敗しました:\n{e}")
             return
 
-        dest_pdf = os.path.join(output_dir, f"{value}.pdf")
+        dest_pdf = self.engine.output_path(value)
 
         # 3.5) 現在ページに既存レコードがあるか確認（あれば更新モード）
+        # 書き込み待ちの保存があればCSVより新しいので、そちらを既存レコードとして扱う
         page_no = self.current_pdf_index + 1
-        existing_row = self.get_csv_row_by_index(page_no)
+        pending = self.pending_saves.get(page_no)
+        existing_row = [pending['value']] if pending else self.get_csv_row_by_index(page_no)
         old_value_in_csv = None
-        old_seq = None
+        old_seq = pending['seq'] if pending else None
         if existing_row:
             try:
                 old_value_in_csv = existing_row[0] if len(existing_row) >= 1 else None
             except Exception:
                 old_value_in_csv = None
-            try:
-                old_seq = int(existing_row[-1])
-            except Exception:
-                old_seq = None
+            if not pending:
+                try:
+                    old_seq = int(existing_row[-1])
+                except Exception:
+                    old_seq = None
 
         # 4) Overwrite confirmation if exists
         # 既存レコードがあり、旧ファイル名→新ファイル名の置換を行うモードでは確認ダイアログなしで実施
         if not existing_row:
-            if os.path.exists(dest_pdf):
+            if os.path.exists(dest_pdf) or self.output_writer.is_pending(dest_pdf):
                 if not messagebox.askyesno("上書き確認", f"既に存在します:\n{dest_pdf}\n上書きしますか？"):
                     self.log_message("保存をキャンセルしました（上書きしない）。")
                     return
 
-        # 5) Copy / Replace
+        placeholder = ""
         try:
-             # 旧PDFの削除（既存レコードがあり、旧値が存在し、新値と異なる場合）
-            if existing_row and old_value_in_csv and old_value_in_csv != value:
-                old_pdf_path = os.path.join(output_dir, f"{old_value_in_csv}.pdf")
-                if os.path.exists(old_pdf_path):
-                    try:
-                        os.remove(old_pdf_path)
-                        self.log_message(f"旧PDFを削除しました: {old_pdf_path}")
-                    except Exception as de:
-                        self.log_message(f"旧PDF削除エラー: {de}")
-            shutil.copy2(src_pdf, dest_pdf)
-            self.log_message(f"保存完了: {dest_pdf}")
-            messagebox.showinfo("保存完了", f"保存しました:\n{dest_pdf}")
-            # CSV: 既存レコードがあればその行を更新、なければ追記
+            if hasattr(self, 'result_var') and self.result_var is not None:
+                placeholder = self.result_var.get()
+        except Exception:
+            placeholder = ""
+
+        entry = {'value': value, 'placeholder': placeholder, 'seq': old_seq}
+
+        def finish():
+            # 同じページがその後に保存し直されていれば、その保存の記録を残す
+            if self.pending_saves.get(page_no) is entry:
+                del self.pending_saves[page_no]
+
+        def saved(dest_path):
+            # CSV: 保存が完了してから記録（既存レコードがあればその行を更新、なければ追記）
+            finish()
             try:
-                placeholder = ""
-                try:
-                    if hasattr(self, 'result_var') and self.result_var is not None:
-                        placeholder = self.result_var.get()
-                except Exception:
-                    placeholder = ""
-                if existing_row:
-                    self.update_csv_row_by_index(page_no, value, placeholder, keep_seq=old_seq)
-                else:
-                    self.append_csv_log(value, placeholder)
+                with SPANS.span('save.csv'):
+                    row = self.get_csv_row_by_index(page_no)
+                    if row:
+                        keep_seq = entry['seq']
+                        if keep_seq is None:
+                            try:
+                                keep_seq = int(row[-1])
+                            except Exception:
+                                keep_seq = None
+                        self.update_csv_row_by_index(page_no, value, placeholder, keep_seq=keep_seq,
+                                                     source_file=os.path.basename(src_pdf))
+                    else:
+                        self.append_csv_log(value, placeholder, source_file=os.path.basename(src_pdf))
             except Exception as e:
                 self.log_message(f"CSVログ出力エラー: {e}")
+
+        def failed(error):
+            # 失敗した保存はCSVに記録しない（詳細は OutputWriter が「保存失敗」としてログに出す）
+            finish()
+            self.log_message(f"ページ{page_no}の {os.path.basename(dest_pdf)} はCSVに記録していません")
+
+        # 5) Copy / Replace（書き込みはバックグラウンド。完了後にCSVへ記録）
+        try:
+            # 既存レコードがあれば旧PDFを置き換える
+            replace_value = old_value_in_csv if existing_row else None
+            # 書き込みは1本のスレッドで順に行うので、再保存は先の保存の出力を置き換える
+            dest_pdf = self.output_writer.submit(src_pdf, value, replace_value=replace_value,
+                                                 on_done=saved, on_error=failed)
+            self.pending_saves[page_no] = entry
+            self.log_message(f"保存を開始: {dest_pdf}")
             # 入力欄を初期化し、ボタン状態を更新
             try:
                 self.entry_var.set("")
@@ -514,87 +3194,103 @@ class PDFRenamerApp:
             except Exception:
                 pass
         except Exception as e:
-            self.log_message(f"保存失敗: コピー中にエラー: {e}")
+            self.log_message(f"保存失敗: {e}")
             messagebox.showerror("エラー", f"コピーに失敗しました:\n{e}")
 
-    def append_csv_log(self, key_value: str, placeholder_text: str):
-        """Append a CSV row 'key_value, placeholder_text, seq' into log_output/rename_log.csv with sequential numbering."""
-        log_dir = self.config.get('log_output_folder') or 'log_output'
-        os.makedirs(log_dir, exist_ok=True)
-        csv_path = self.current_csv_path
+    def poll_background_jobs(self):
+        """Show finished worker results (runs on the Tk thread)."""
+        try:
+            self.jobs.poll()
+            if self.folder_watcher is not None:
+                self.add_new_pdf_files(self.folder_watcher.poll())
+        except Exception as e:
+            self.log_message(f"表示更新エラー: {e}")
+        self.root.after(20, self.poll_background_jobs)
+
+    def flush_log_pane(self, reschedule=True):
+        """Show the lines logged since the last flush in one insert (runs on the Tk thread)."""
+        try:
+            lines, skipped = self.log_buffer.take()
+            if lines:
+                if skipped:
+                    where = f"（全文は {self.log_buffer.path}）" if self.log_buffer.path else ""
+                    lines.insert(0, f"... {skipped} 行省略{where}\n")
+                self.log_text.insert(tk.END, "".join(lines))
+                # 表示は最新 log_max_lines 行まで（古い行から削除）
+                excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.log_buffer.max_lines
+                if excess > 0:
+                    self.log_text.delete('1.0', f'{excess + 1}.0')
+                self.log_text.see(tk.END)
+        except Exception:
+            pass
+        if reschedule:
+            self.root.after(self.config.get('log_flush_ms', 200), self.flush_log_pane)
 
-        # Determine next sequence number by reading last valid row
-        next_seq = 1
-        if os.path.exists(csv_path):
-            try:
-                with open(csv_path, 'r', encoding='utf-8', newline='') as f:
-                    reader = csv.reader(f)
-                    last_seq = 0
-                    for row in reader:
-                        if not row:
-                            continue
-                        try:
-                            # Use the last column as seq to support both 2-col and 3-col historical formats
-                            last_seq = int(row[-1])
-                        except Exception:
-                            continue
-                    next_seq = last_seq + 1 if last_seq >= 0 else 1
-            except Exception as e:
-                # 読み取り失敗時は1から（新規扱い）
-                self.log_message(f"CSV読み込みエラー: {e} -> 連番を1から開始します")
-                next_seq = 1
+    def toggle_span_summary(self, event=None):
+        """Show or hide the per-stage latency table over the PDF view (F12)."""
+        if self._span_summary is not None:
+            self._span_summary.destroy()
+            self._span_summary = None
+            return
+        self._span_summary = tk.Label(self.pdf_canvas, justify=tk.LEFT, anchor='nw', font=('Courier', 9),
+                                      bg='#ffffe0', relief=tk.SOLID, borderwidth=1)
+        self._span_summary.place(x=8, y=8)
+        self.refresh_span_summary()
 
-        # Append new row
-        with open(csv_path, 'a', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([key_value, placeholder_text, next_seq])
-        self.log_message(f"CSV出力: {csv_path} に {key_value},{placeholder_text},{next_seq} を追記")
+    def refresh_span_summary(self):
+        if self._span_summary is None:
+            return
+        text = SPANS.format_summary() if SPANS.enabled else "trace_spans=0（計測無効）"
+        self._span_summary.configure(text=text)
+        self.root.after(1000, self.refresh_span_summary)
 
-    def get_csv_row_by_index(self, index_1based: int):
-        """Return the row (list[str]) at 1-based index from the current CSV file if exists, else None."""
+    def export_spans(self):
+        """Log the latency summary and write the Chrome trace next to the session CSV."""
+        if not SPANS.enabled or SPANS.path is None:
+            return
+        self.log_message("処理時間:\n" + SPANS.format_summary())
+        trace_path = os.path.splitext(self.current_csv_path)[0] + '.trace.json'
         try:
-            log_dir = self.config.get('log_output_folder') or 'log_output'
-            csv_path = self.current_csv_path
-            if not os.path.exists(csv_path):
-                return None
-            with open(csv_path, 'r', encoding='utf-8', newline='') as f:
-                reader = csv.reader(f)
-                for i, row in enumerate(reader, start=1):
-                    if i == index_1based:
-                        return row
-            return None
+            SPANS.export_chrome_trace(trace_path)
+            self.log_message(f"トレース: {trace_path}")
         except Exception as e:
-            self.log_message(f"CSV読み込みエラー(get_csv_row_by_index): {e}")
-            return None
+            self.log_message(f"トレース書き出しエラー: {e}")
+        SPANS.close()
+
+    def poll_output_writer(self, reschedule=True):
+        """Show output writer results in the log pane (runs on the Tk thread)."""
+        for message in self.output_writer.poll():
+            self.log_message(message)
+        if reschedule:
+            self.root.after(100, self.poll_output_writer)
+
+    def append_csv_log(self, key_value: str, placeholder_text: str, source_file: str | None = None):
+        """Append a CSV row 'key_value, placeholder_text, seq' to the session log with sequential numbering."""
+        _, next_seq = self.session_log.append(key_value, placeholder_text, source_file=source_file)
+        self.log_message(f"CSV出力: {self.current_csv_path} に {key_value},{placeholder_text},{next_seq} を追記")
+
+    def get_csv_row_by_index(self, index_1based: int):
+        """Return the row (list[str]) at 1-based index from the session log if exists, else None."""
+        return self.session_log.get(index_1based)
+
+    def get_page_record(self, index_1based: int):
+        """Return [value, placeholder] of a save still being written for the page, else its CSV row."""
+        pending = self.pending_saves.get(index_1based)
+        if pending:
+            return [pending['value'], pending['placeholder']]
+        return self.get_csv_row_by_index(index_1based)
 
-    def update_csv_row_by_index(self, index_1based: int, key_value: str, placeholder_text: str, keep_seq: int | None = None):
-        """Update a specific 1-based row in the current CSV with new values while preserving sequence if provided.
+    def update_csv_row_by_index(self, index_1based: int, key_value: str, placeholder_text: str, keep_seq: int | None = None,
+                                source_file: str | None = None):
+        """Update a specific 1-based row in the session log with new values while preserving sequence if provided.
         If the index is beyond current rows, does nothing and returns False.
         Returns True if updated, else False.
         """
         try:
-            csv_path = self.current_csv_path
-            if not os.path.exists(csv_path):
+            if not self.session_log.update(index_1based, key_value, placeholder_text, keep_seq=keep_seq,
+                                           source_file=source_file):
                 return False
-            rows: list[list[str]] = []
-            with open(csv_path, 'r', encoding='utf-8', newline='') as f:
-                rows = list(csv.reader(f))
-            if index_1based < 1 or index_1based > len(rows):
-                return False
-            old_row = rows[index_1based - 1]
-            seq_val = None
-            if keep_seq is not None:
-                seq_val = keep_seq
-            else:
-                try:
-                    seq_val = int(old_row[-1])
-                except Exception:
-                    seq_val = index_1based  # フォールバック
-            rows[index_1based - 1] = [key_value, placeholder_text, seq_val]
-            with open(csv_path, 'w', encoding='utf-8', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerows(rows)
-            self.log_message(f"CSV更新: {csv_path} の {index_1based} 行目を書き換え")
+            self.log_message(f"CSV更新: {self.current_csv_path} の {index_1based} 行目を書き換え")
             return True
         except Exception as e:
             self.log_message(f"CSV更新エラー(update_csv_row_by_index): {e}")
@@ -627,21 +3323,48 @@ class PDFRenamerApp:
         """Save config on exit and close the app"""
         try:
             self.save_config()
+            self.log_message(f"描画キャッシュ: {self.render_cache.stats()}")
             self.log_message("設定を保存して終了します。")
         except Exception as e:
             self.log_message(f"設定保存中にエラー: {e}")
         finally:
+            try:
+                self.jobs.close()
+                if self.folder_watcher is not None:
+                    self.folder_watcher.close()
+            except Exception:
+                pass
+            try:
+                # 書き込み待ちの出力PDFを完了させてから終了
+                self.output_writer.close()
+                self.poll_output_writer(reschedule=False)
+            except Exception:
+                pass
+            try:
+                self.session_log.close()
+            except Exception as e:
+                self.log_message(f"CSV書き込みエラー: {e}")
+            try:
+                self.prefetcher.close()
+                self.engine.close()
+            except Exception:
+                pass
+            try:
+                self.export_spans()
+            except Exception:
+                pass
+            try:
+                self.log_buffer.close()
+            except Exception:
+                pass
             try:
                 self.root.destroy()
             except Exception:
                 pass
     
     def log_message(self, message):
-        """Add message to log"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        """Add message to log (any thread; shown by flush_log_pane())"""
+        self.log_buffer.write(message)
     
     def select_input_folder(self):
         """Select input folder containing PDF files"""
@@ -656,90 +3379,203 @@ class PDFRenamerApp:
         input_folder = self.config['pdf_input_folder']
         if not os.path.exists(input_folder):
             self.log_message(f"入力フォルダが見つかりません: {input_folder}")
+            if self.folder_watcher is not None:
+                self.folder_watcher.close()
+                self.folder_watcher = None
             return
         
-        # Get all PDF files and sort them
-        self.pdf_files = [f for f in os.listdir(input_folder) if f.lower().endswith('.pdf')]
-        self.pdf_files.sort()
-        
-        if self.pdf_files:
+        # PDFの一覧はワーカーで自然順に列挙し、見つかった分から少しずつ追加する
+        # （最初のPDFは列挙の完了を待たずに表示し、総数は後から確定）
+        recursive = bool(self.config.get('input_recursive', 0))
+        self.pdf_files = []
+        self.current_pdf_index = 0
+        self._discovering = True
+        if self.folder_watcher is not None:
+            self.folder_watcher.close()
+            self.folder_watcher = None
+
+        def discover(report):
+            chunk = []
+            found = 0
+            last = time.monotonic()
+            for name in iter_pdf_files(input_folder, recursive=recursive):
+                chunk.append(name)
+                found += 1
+                now = time.monotonic()
+                if found == 1 or len(chunk) >= 1000 or now - last >= 0.2:
+                    if not report(chunk):
+                        return None
+                    chunk = []
+                    last = now
+            if chunk and not report(chunk):
+                return None
+            return found
+
+        def add_chunk(chunk):
+            was_empty = not self.pdf_files
+            self.pdf_files.extend(chunk)
+            if was_empty:
+                self.load_current_pdf()
+            else:
+                self.update_file_info()
+
+        def finished(found):
+            self._discovering = False
+            # 列挙が終わってから監視を始める（列挙済みのPDFは追加しない）
+            self.start_folder_watch(input_folder)
+            if found:
+                self.log_message(f"{found}個のPDFファイルを読み込みました")
+                self.update_file_info()
+                self.schedule_prefetch()
+            else:
+                self.log_message("PDFファイルが見つかりません")
+
+        def failed(error):
+            self._discovering = False
+            self.log_message(f"PDF一覧の取得エラー: {error}")
+
+        self.jobs.submit('discover', discover, finished, on_error=failed, on_progress=add_chunk)
+    
+    def start_folder_watch(self, input_folder):
+        """(Re)start watching input_folder for newly scanned PDFs."""
+        if self.folder_watcher is not None:
+            self.folder_watcher.close()
+            self.folder_watcher = None
+        if not self.config.get('watch_input_folder', 1):
+            return
+        self.folder_watcher = FolderWatcher(input_folder, known=self.pdf_files,
+                                            settle=self.config.get('watch_settle_seconds', 2.0),
+                                            recursive=bool(self.config.get('input_recursive', 0)),
+                                            log=self.log_message).start()
+
+    def add_new_pdf_files(self, names):
+        """Append newly arrived PDFs to the work list, keeping the current position."""
+        if not names:
+            return
+        was_empty = not self.pdf_files
+        self.pdf_files.extend(names)
+        self.log_message(f"新しいPDFを{len(names)}件追加しました（全{len(self.pdf_files)}件）")
+        if was_empty:
             self.current_pdf_index = 0
-            self.log_message(f"{len(self.pdf_files)}個のPDFファイルを読み込みました")
             self.load_current_pdf()
         else:
-            self.log_message("PDFファイルが見つかりません")
-    
-    def load_current_pdf(self):
-        """Load and display current PDF"""
-        # ocr_get_imageフォルダ内のpngファイルを削除
-        ocr_folder = self.config.get('ocr_image_folder')
-        if ocr_folder and os.path.isdir(ocr_folder):
-            for filename in os.listdir(ocr_folder):
-                if filename.lower().endswith('.png'):
-                    try:
-                        os.remove(os.path.join(ocr_folder, filename))
-                    except Exception as e:
-                        self.log_message(f"PNGファイル削除エラー: {e}")
+            self.update_file_info()
+            self.schedule_prefetch()
 
+    def load_current_pdf(self):
+        """Load and display current PDF (opened on a worker thread)"""
         if not self.pdf_files:
             return
-        
-        pdf_path = os.path.join(self.config['pdf_input_folder'], self.pdf_files[self.current_pdf_index])
-        
-        try:
-            # Close previous document
-            if self.current_pdf_doc:
-                self.current_pdf_doc.close()
 
-            # Open new document
-            self.current_pdf_doc = fitz.open(pdf_path)
+        started = time.perf_counter()
+        name = self.pdf_files[self.current_pdf_index]
+        pdf_path = os.path.join(self.config['pdf_input_folder'], name)
+
+        # 直前のPDFは「前へ」用に先読み側へ戻す（同じPDFならそこから取り直す）
+        previous = self._current_entry
+        self._current_entry = None
+        self.current_pdf_doc = None
+        if previous is not None:
+            self.prefetcher.store(previous)
+        # 前のページ向けの描画・OCR結果は表示しない
+        for channel in ('viewer', 'areas', 'ocr'):
+            self.jobs.cancel(channel)
+        self.update_file_info()
+
+        def load():
+            # 先読み済みなら描画済みビットマップをそのまま使う
+            entry = self.prefetcher.take(pdf_path)
+            if entry is None:
+                with FITZ_LOCK, SPANS.span('page.open'):
+                    entry = PrefetchedPDF(pdf_path, fitz.open(pdf_path), cache=self.render_cache)
+            return entry
+
+        def show(entry):
+            # ページ移動から表示できるまで（ワーカー待ちを含む）
+            SPANS.add('page.load', started, time.perf_counter() - started)
+            self._current_entry = entry
+            self.current_pdf_doc = entry.doc
 
             # Render into viewer
             self.render_current_page()
 
-            # Update file info and side images
-            self.update_file_info()
+            # Update side images
             self.update_display_images()
 
-            self.log_message(f"PDFを読み込みました: {self.pdf_files[self.current_pdf_index]}")
+            self.log_message(f"PDFを読み込みました: {name}")
 
-        except Exception as e:
-            self.log_message(f"PDFの読み込みエラー: {str(e)}")
+        # 追い越された読み込み結果は先読み側へ渡して再利用する
+        self.jobs.submit('page', load, show,
+                         on_error=lambda e: self.log_message(f"PDFの読み込みエラー: {str(e)}"),
+                         on_stale=self.prefetcher.store)
 
-    def render_current_page(self):
-        """Render the first page left-half and display filling the PDF canvas."""
-        if not self.current_pdf_doc:
-            return
+    def get_render_params(self):
+        """Snapshot canvas sizes and frame rects that determine the rendered bitmaps."""
         try:
-            page = self.current_pdf_doc[0]
-            # Render page to image
-            mat = fitz.Matrix(2.0, 2.0)
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("ppm")
+            viewer_size = (self.pdf_canvas.winfo_width(), self.pdf_canvas.winfo_height())
+        except Exception:
+            return None
+        areas = self.get_area_params()
+        if areas is None or min(viewer_size) <= 1:
+            return None
+        return viewer_size, areas
+
+    def get_area_params(self):
+        """Snapshot [(area_type, rect, canvas_size)] for the red/blue frame previews."""
+        try:
+            center_size = (self.center_canvas.winfo_width(), self.center_canvas.winfo_height())
+            right_size = (self.right_canvas.winfo_width(), self.right_canvas.winfo_height())
+        except Exception:
+            return None
+        if min(center_size + right_size) <= 1:
+            return None
+        areas = []
+        for area_type, prefix, size in (('center', 'red_frame', center_size), ('right', 'blue_frame', right_size)):
+            keys = [f'{prefix}_x', f'{prefix}_y', f'{prefix}_width', f'{prefix}_height']
+            if all(key in self.config for key in keys):
+                x, y, w, h = (self.config[key] for key in keys)
+                areas.append((area_type, (x, y, x + w, y + h), size))
+        return areas
 
-            pil_image = Image.open(io.BytesIO(img_data))
+    def schedule_prefetch(self):
+        """Queue the next prefetch_depth PDFs and the previous one for background rendering."""
+        params = self.get_render_params()
+        if params is None or not self.pdf_files:
+            return
+        folder = self.config['pdf_input_folder']
+        index = self.current_pdf_index
+        upcoming = self.pdf_files[index + 1:index + 1 + self.prefetcher.depth]
+        paths = [os.path.join(folder, name) for name in upcoming]
+        if index > 0:
+            paths.append(os.path.join(folder, self.pdf_files[index - 1]))
+        self.prefetcher.schedule(paths, params)
 
-            # Crop to left half (app仕様に合わせて維持)
-            width, height = pil_image.size
-            left_half = pil_image.crop((0, 0, width // 2, height))
+    def render_current_page(self):
+        """Render the first page left-half (on a worker, draft first) and display filling the PDF canvas."""
+        if not self.current_pdf_doc or self._current_entry is None:
+            return
+        # Canvas size
+        canvas_width = max(1, self.pdf_canvas.winfo_width())
+        canvas_height = max(1, self.pdf_canvas.winfo_height())
+        entry = self._current_entry
+        size = (canvas_width, canvas_height)
+        draft = self.config.get('draft_scale', 0.25)
 
-            # Canvas size
-            canvas_width = max(1, self.pdf_canvas.winfo_width())
-            canvas_height = max(1, self.pdf_canvas.winfo_height())
+        def render(report):
+            # まず低解像度の下書きを表示し、精細な描画が終わったら差し替える
+            if draft and not entry.has_viewer(size):
+                with SPANS.span('viewer.draft'):
+                    image = entry.viewer_draft(size, draft)
+                report(image)
+            with SPANS.span('viewer.render'):
+                return entry.viewer(size)
 
-            # Scale to cover (fill) the canvas while preserving aspect ratio
-            img_w, img_h = left_half.size
-            scale = max(canvas_width / img_w, canvas_height / img_h)
-            new_w = int(img_w * scale)
-            new_h = int(img_h * scale)
-            resized = left_half.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        def show(result):
+            with SPANS.span('viewer.show'):
+                display(result)
 
-            # Center-crop to canvas size for true full-screen fill
-            left = max(0, (new_w - canvas_width) // 2)
-            top = max(0, (new_h - canvas_height) // 2)
-            right = left + canvas_width
-            bottom = top + canvas_height
-            filled = resized.crop((left, top, right, bottom))
+        def display(result):
+            filled, scale, left, top = result
 
             # Save transform state
             self._render_scale = scale
@@ -754,8 +3590,8 @@ class PDFRenamerApp:
             # Draw red and blue frames
             self.draw_frames()
 
-        except Exception as e:
-            self.log_message(f"PDF描画エラー: {str(e)}")
+        self.jobs.submit('viewer', render, show, on_progress=show,
+                         on_error=lambda e: self.log_message(f"PDF描画エラー: {str(e)}"))
 
     def on_pdf_canvas_configure(self, event):
         """Re-render current page when the PDF canvas size changes."""
@@ -789,7 +3625,9 @@ class PDFRenamerApp:
         """Update file information display"""
         if self.pdf_files:
             current_file = self.pdf_files[self.current_pdf_index]
-            info_text = f"{current_file} ({self.current_pdf_index + 1}/{len(self.pdf_files)})"
+            # 一覧の列挙中は総数が未確定
+            total = f"{len(self.pdf_files)}+" if self._discovering else f"{len(self.pdf_files)}"
+            info_text = f"{current_file} ({self.current_pdf_index + 1}/{total})"
             self.file_info_label.config(text=info_text)
             # Prevボタンは1ページ目では無効化
             try:
@@ -811,7 +3649,7 @@ class PDFRenamerApp:
                     next_page_no = self.current_pdf_index + 2  # 1始まり
                     has_row = False
                     try:
-                        row = self.get_csv_row_by_index(next_page_no)
+                        row = self.get_page_record(next_page_no)
                         has_row = bool(row)
                     except Exception:
                         has_row = False
@@ -825,7 +3663,7 @@ class PDFRenamerApp:
                         self.next_button.configure(state='disabled')
                     else:
                         next_page_no = self.current_pdf_index + 2
-                        row = self.get_csv_row_by_index(next_page_no)
+                        row = self.get_page_record(next_page_no)
                         self.next_button.configure(state='normal' if row else 'disabled')
                 except Exception:
                     pass
@@ -834,95 +3672,33 @@ class PDFRenamerApp:
         """Extract text from OCR area"""
         if not self.current_pdf_doc:
             return
-        try:
-            page = self.current_pdf_doc[0]
-            
-            # Define OCR area rectangle
-            rect = fitz.Rect(
-                self.config['ocr_x'],
-                self.config['ocr_y'],
-                self.config['ocr_x'] + self.config['ocr_width'],
-                self.config['ocr_y'] + self.config['ocr_height']
-            )
-            
-            # Extract image from OCR area
-            mat = fitz.Matrix(4.0, 4.0)  # High resolution for OCR
-            pix = page.get_pixmap(matrix=mat, clip=rect)
-            img_data = pix.tobytes("ppm")
-            
-            # Convert to OpenCV format for processing
-            pil_image = Image.open(io.BytesIO(img_data))
-            cv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-            
-            # Image preprocessing for better OCR
-            processed_image = self.preprocess_image_for_ocr(cv_image)
-            
-            # Save OCR image
-            # Windowsのファイルシステムエンコーディング問題を回避するための処理
-            base_name = os.path.splitext(self.pdf_files[self.current_pdf_index])[0]
-            try:
-                # エンコーディングの不整合を修正する
-                corrected_name = base_name.encode('utf-8').decode('cp932')
-            except (UnicodeEncodeError, UnicodeDecodeError):
-                corrected_name = base_name # 変換に失敗した場合は元の名前を使用
-
-            ocr_image_filename = f"{corrected_name}_ocr.png"
-            ocr_image_path = os.path.join(self.config['ocr_image_folder'], ocr_image_filename)
-            # cv2.imwriteは日本語ファイルパスをサポートしないため、エンコードしてから書き込む
-            result, encoded_image = cv2.imencode('.png', processed_image)
-            if result:
-                with open(ocr_image_path, 'wb') as f:
-                    f.write(encoded_image)
-            
-            # Display OCR image
-            self.display_ocr_image(processed_image)
-            
-            # Perform OCR
-            text = self.perform_ocr(processed_image)
-            
-            # Extract digits
-            extracted_digits = self.extract_digits(text)
+        base_name = os.path.splitext(os.path.basename(self.pdf_files[self.current_pdf_index]))[0]
+        page = self.current_pdf_doc[0]
+
+        def show(result):
+            if result.error:
+                failed(result.error)
+                return
             
-            # Update filename entry
-            self.filename_entry.delete(0, tk.END)
-            self.filename_entry.insert(0, extracted_digits)
+            # Display OCR image（テキストレイヤー・キャッシュ時は前処理画像なし）
+            if result.image is not None:
+                self.display_ocr_image(result.image)
             
-            self.log_message(f"OCR結果: {text} -> 抽出: {extracted_digits}")
+            # Update entry
+            self.entry_var.set(result.digits)
             
-        except Exception as e:
-            self.log_message(f"OCRエラー: {str(e)}")
-            self.filename_entry.delete(0, tk.END)
-    
-    def preprocess_image_for_ocr(self, image):
-        """Preprocess image for better OCR accuracy"""
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced = clahe.apply(gray)
-        
-        # Median blur to reduce noise
-        denoised = cv2.medianBlur(enhanced, 3)
-        
-        # Adaptive thresholding
-        binary = cv2.adaptiveThreshold(
-            denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10
-        )
-        
-        # Morphological operations
-        kernel = np.ones((2, 2), np.uint8)
-        closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel, iterations=1)
-        
-        # Dilate to thicken text
-        dilated = cv2.dilate(closed, np.ones((1, 1), np.uint8), iterations=1)
-        
-        # Resize for better OCR
-        height, width = dilated.shape
-        resized = cv2.resize(dilated, (int(width * 1.8), int(height * 1.8)), 
-                           interpolation=cv2.INTER_LANCZOS4)
-        
-        return resized
+            self.log_message(f"OCR結果: {result.text} -> 抽出: {result.digits} ({result.label})")
+
+        def failed(error):
+            self.log_message(f"OCRエラー: {str(error)}")
+            self.entry_var.set("")
+
+        # OCRはワーカーで実行（ページ移動後の結果は捨てる）
+        def read():
+            with SPANS.span('ocr.page'):
+                return self.engine.extract_ocr_text(page, base_name=base_name)
+
+        self.jobs.submit('ocr', read, show, on_error=failed)
     
     def display_ocr_image(self, cv_image):
         """Display OCR image in the OCR canvas"""
@@ -948,39 +3724,6 @@ class PDFRenamerApp:
         except Exception as e:
             self.log_message(f"OCR画像表示エラー: {str(e)}")
     
-    def perform_ocr(self, image):
-        """Perform OCR on preprocessed image"""
-        try:
-            # OCR configuration for digits and hyphens only
-            config = "--oem 1 --psm 7 -c tessedit_char_whitelist=0123456789- " \
-                    "-c load_system_dawg=0 -c load_freq_dawg=0"
-            
-            text = pytesseract.image_to_string(image, config=config, lang='eng')
-            return text.strip()
-            
-        except Exception as e:
-            self.log_message(f"OCR実行エラー: {str(e)}")
-            return ""
-    
-    def extract_digits(self, text):
-        """Extract 8-digit + 999 pattern from OCR text"""
-        # Remove all non-digit characters except hyphens
-        cleaned = re.sub(r'[^0-9-]', '', text)
-        
-        # Look for 8-digit + 999 pattern
-        pattern = r'(\d{8}).*?(\d{3})'
-        match = re.search(pattern, cleaned)
-        
-        if match:
-            return match.group(1)  # Return 8-digit part
-        
-        # Fallback: extract first 8 digits
-        digits_only = re.sub(r'[^0-9]', '', cleaned)
-        if len(digits_only) >= 8:
-            return digits_only[:8]
-        
-        return digits_only
-    
     def set_ocr_area(self):
         """Enable OCR area selection mode"""
         self.selecting_area = True
@@ -1109,7 +3852,7 @@ class PDFRenamerApp:
             # 前ページのページ番号（1始まり）に対応するCSV行をフォームへ反映
             try:
                 page_no = self.current_pdf_index + 1
-                row = self.get_csv_row_by_index(page_no)
+                row = self.get_page_record(page_no)
                 if row:
                     # row: [value] or [value, placeholder] or [value, placeholder, seq]
                     value = row[0] if len(row) >= 1 else ""
@@ -1137,7 +3880,7 @@ class PDFRenamerApp:
             # 次ページのページ番号（1始まり）に対応するCSV行をフォームへ反映（prevと同様）
             try:
                 page_no = self.current_pdf_index + 1
-                row = self.get_csv_row_by_index(page_no)
+                row = self.get_page_record(page_no)
                 if row:
                     value = row[0] if len(row) >= 1 else ""
                     placeholder = row[1] if len(row) >= 2 else ""
@@ -1220,23 +3963,47 @@ class PDFRenamerApp:
         except Exception:
             pass
         
-        try:
-            page = self.current_pdf_doc[0]
-            
-            # Update center display (red frame area)
-            if all(key in self.config for key in ['red_frame_x', 'red_frame_y', 'red_frame_width', 'red_frame_height']):
-                self.extract_and_display_area('center', 
-                    self.config['red_frame_x'], self.config['red_frame_y'],
-                    self.config['red_frame_width'], self.config['red_frame_height'])
-            
-            # Update right display (blue frame area)
-            if all(key in self.config for key in ['blue_frame_x', 'blue_frame_y', 'blue_frame_width', 'blue_frame_height']):
-                self.extract_and_display_area('right',
-                    self.config['blue_frame_x'], self.config['blue_frame_y'],
-                    self.config['blue_frame_width'], self.config['blue_frame_height'])
-                    
-        except Exception as e:
-            self.log_message(f"画像表示エラー: {str(e)}")
+        areas = self.get_area_params()
+        if areas is None or self._current_entry is None:
+            return
+        entry = self._current_entry
+        draft = self.config.get('draft_scale', 0.25)
+
+        def render(report):
+            # 未描画のエリアは先に下書きを表示
+            if draft:
+                with SPANS.span('areas.draft'):
+                    drafts = [(area_type, size, entry.area_draft(rect, size, draft))
+                              for area_type, rect, size in areas if not entry.has_area(area_type, rect, size)]
+                if drafts:
+                    report(drafts)
+            # Update center (red frame) and right (blue frame) displays
+            results = []
+            for area_type, rect, size in areas:
+                try:
+                    with SPANS.span('areas.render', area=area_type):
+                        results.append((area_type, size, entry.area(area_type, rect, size), None))
+                except Exception as e:
+                    results.append((area_type, size, None, e))
+            return results
+
+        def show_drafts(drafts):
+            for area_type, size, pil_image in drafts:
+                self.display_area_image(area_type, pil_image, size)
+
+        def show(results):
+            for area_type, size, pil_image, error in results:
+                if error is not None:
+                    self.log_message(f"{area_type}エリア画像抽出エラー: {str(error)}")
+                else:
+                    with SPANS.span('areas.show', area=area_type):
+                        self.display_area_image(area_type, pil_image, size)
+
+            # 表示サイズが確定したので、同じサイズで前後のPDFを先読み
+            self.schedule_prefetch()
+
+        self.jobs.submit('areas', render, show, on_progress=show_drafts,
+                         on_error=lambda e: self.log_message(f"画像表示エラー: {str(e)}"))
     
     def on_side_canvas_configure(self, event):
         """Debounced update of side preview images on canvas resize."""
@@ -1247,48 +4014,37 @@ class PDFRenamerApp:
                 pass
         self._side_resize_after_id = self.root.after(50, self.update_display_images)
     
-    def extract_and_display_area(self, area_type, x, y, width, height):
-        """Extract and display image from specified area"""
-        try:
-            page = self.current_pdf_doc[0]
-            
-            # Define area rectangle
-            rect = fitz.Rect(x, y, x + width, y + height)
-            
-            # Extract image from area
-            mat = fitz.Matrix(2.0, 2.0)  # Scale factor
-            pix = page.get_pixmap(matrix=mat, clip=rect)
-            img_data = pix.tobytes("ppm")
-            
-            # Convert to PIL Image
-            pil_image = Image.open(io.BytesIO(img_data))
-            
-            # Get target canvas
-            target_canvas = self.center_canvas if area_type == 'center' else self.right_canvas
-            
-            # Resize to fit canvas
-            canvas_width = target_canvas.winfo_width()
-            canvas_height = target_canvas.winfo_height()
-            
-            if canvas_width > 1 and canvas_height > 1:
-                pil_image.thumbnail((canvas_width, canvas_height), Image.Resampling.LANCZOS)
-            
-            # Convert to PhotoImage and display
-            if area_type == 'center':
-                self.center_image = ImageTk.PhotoImage(pil_image)
-                self.center_canvas.delete("all")
-                self.center_canvas.create_image(canvas_width//2, canvas_height//2, image=self.center_image)
-            else:
-                self.right_image = ImageTk.PhotoImage(pil_image)
-                self.right_canvas.delete("all")
-                self.right_canvas.create_image(canvas_width//2, canvas_height//2, image=self.right_image)
-                
-        except Exception as e:
-            self.log_message(f"{area_type}エリア画像抽出エラー: {str(e)}")
+    def display_area_image(self, area_type, pil_image, size):
+        """Display a rendered frame-area image on the center or right canvas"""
+        canvas_width, canvas_height = size
+        # Convert to PhotoImage and display
+        if area_type == 'center':
+            self.center_image = ImageTk.PhotoImage(pil_image)
+            self.center_canvas.delete("all")
+            self.center_canvas.create_image(canvas_width//2, canvas_height//2, image=self.center_image)
+        else:
+            self.right_image = ImageTk.PhotoImage(pil_image)
+            self.right_canvas.delete("all")
+            self.right_canvas.create_image(canvas_width//2, canvas_height//2, image=self.right_image)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF Renamer")
+    parser.add_argument('--batch', nargs=2, metavar=('INPUT', 'OUTPUT'),
+                        help="UIを起動せずINPUTフォルダのPDFを一括OCRしOUTPUTへ保存")
+    parser.add_argument('--unresolved', metavar='DIR',
+                        help="一括処理で番号を確定できなかったPDFのコピー先（GUIで処理）")
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        configure_tesseract()
+        run_batch(args.batch[0], args.batch[1], unresolved_folder=args.unresolved)
+        return 0
 
-if __name__ == "__main__":
-    import io
-    
     root = tk.Tk()
     app = PDFRenamerApp(root)
     root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())